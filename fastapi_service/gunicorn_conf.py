@@ -0,0 +1,18 @@
+"""
+Gunicorn config for the NLP service.
+
+    cd fastapi_service
+    gunicorn main:app -c gunicorn_conf.py
+
+Each worker runs its own event loop; set REDIS_URL so workers share the
+response cache instead of recomputing each other's results.
+"""
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+keepalive = 75
+# Long documents can take minutes of LLM time across all pages
+timeout = 180
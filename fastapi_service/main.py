@@ -1,129 +1,608 @@
 import os
-from fastapi import FastAPI, HTTPException
+import sys
+import atexit
+import asyncio
+import functools
+import hashlib
+import logging
+import logging.handlers
+import queue
+import httpx
+import orjson
+import structlog
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, computed_field, field_validator
+from pydantic_core import PydanticCustomError
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, List
 from dotenv import load_dotenv
-from nlp_engine import process_document, ask_document, summarize_text, extract_key_points
+from nlp_engine import (
+    process_document, ask_document, process_document_iter,
+    process_document_stream, ask_document_stream, summarize_text_stream, extract_key_points_stream,
+    summarize_batch, extract_batch, set_http_client, close_http_client,
+    load_token_encoding,
+)
 
 load_dotenv()
 
-app = FastAPI(title="Technical Briefing Simplifier - NLP Service", version="3.0.0")
+# ─── Logging ────────────────────────────────────────────────────────────────
+#
+# Records are rendered as JSON on the calling side and handed to a queue; a
+# background QueueListener thread does the actual stderr writes, so the event
+# loop never blocks on stdio. structlog events and plain stdlib records (from
+# nlp_engine, utils.file_parser, uvicorn) go through the same JSON renderer.
+
+_timestamper = structlog.processors.TimeStamper(fmt="iso")
+_json_formatter = structlog.stdlib.ProcessorFormatter(
+    foreign_pre_chain=[
+        structlog.stdlib.add_logger_name,
+        structlog.stdlib.add_log_level,
+        _timestamper,
+    ],
+    processors=[
+        structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+        structlog.processors.format_exc_info,
+        structlog.processors.JSONRenderer(serializer=lambda obj, **kw: orjson.dumps(obj).decode()),
+    ],
+)
+
+_log_queue: queue.Queue = queue.Queue(-1)
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(_json_formatter)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, logging.StreamHandler(sys.stderr), respect_handler_level=True
+)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    handlers=[_log_queue_handler],
+    force=True,  # replace the default handler nlp_engine installs on import
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+structlog.configure(
+    processors=[
+        structlog.stdlib.add_logger_name,
+        structlog.stdlib.add_log_level,
+        _timestamper,
+        structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+    ],
+    logger_factory=structlog.stdlib.LoggerFactory(),
+    wrapper_class=structlog.stdlib.BoundLogger,
+    cache_logger_on_first_use=True,
+)
+log = structlog.get_logger("nlp_service")
+
+try:
+    import redis.asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+try:
+    from blake3 import blake3
+    HAS_BLAKE3 = True
+except ImportError:
+    HAS_BLAKE3 = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP/2 client for all upstream Perplexity calls in this worker
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=60.0,
+    )
+    set_http_client(app.state.http)
+    # May download the encoding file; keep that off the event loop
+    await asyncio.to_thread(load_token_encoding)
+    yield
+    set_http_client(None)
+    await app.state.http.aclose()
+    await close_http_client()
+    if _redis is not None:
+        await _redis.aclose()
+
+
+app = FastAPI(
+    title="Technical Briefing Simplifier - NLP Service",
+    version="3.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+# Comma-separated; the Node backend calls this service server-to-server, so
+# only browser origins that talk to it directly need to be listed.
+ALLOWED_ORIGINS = tuple(
+    origin.strip()
+    for origin in os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:5175").split(",")
+    if origin.strip()
+)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=("GET", "POST", "OPTIONS"),
+    allow_headers=("Authorization", "Content-Type"),
 )
 
 
+STREAM_ENDPOINTS = ("/process/stream", "/process/pages", "/ask/stream", "/summarize/stream", "/extract/stream")
+
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    """GZip responses except on streaming routes, whose frames must flush immediately."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in STREAM_ENDPOINTS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+
+@app.options("/{path:path}")
+async def options_passthrough(path: str):
+    """Answer bare OPTIONS requests without touching the POST handlers.
+
+    CORS preflights are answered by CORSMiddleware before reaching here.
+    """
+    return Response(status_code=204)
+
+
 # ─── Request/Response Models ────────────────────────────────────────────────
 
-class ProcessRequest(BaseModel):
+EMPTY_FIELD_ERROR = "empty_field"
+
+
+def require_content(value: str, message: str) -> str:
+    """Reject empty/whitespace-only strings without allocating a stripped copy."""
+    if not value or value.isspace():
+        raise PydanticCustomError(EMPTY_FIELD_ERROR, message)
+    return value
+
+
+class NLPRequest(BaseModel):
+    # Whitespace is trimmed once in pydantic-core while parsing
+    model_config = ConfigDict(str_strip_whitespace=True, extra="ignore")
+
+
+class ProcessRequest(NLPRequest):
     text: str
     audience_level: Optional[str] = "manager"
     user_id: Optional[str] = "default"
 
-class AskRequest(BaseModel):
+    @field_validator("text")
+    @classmethod
+    def _text_nonempty(cls, v: str) -> str:
+        return require_content(v, "No text provided")
+
+    @computed_field
+    @property
+    def preview(self) -> str:
+        """Document excerpt shown in the error fallback."""
+        return self.text[:500]
+
+
+class AskRequest(NLPRequest):
     text: str
     question: str
     user_id: Optional[str] = "default"
 
-class SummarizeRequest(BaseModel):
+    @field_validator("text")
+    @classmethod
+    def _text_nonempty(cls, v: str) -> str:
+        return require_content(v, "No document text provided")
+
+    @field_validator("question")
+    @classmethod
+    def _question_nonempty(cls, v: str) -> str:
+        return require_content(v, "No question provided")
+
+
+class SummarizeRequest(NLPRequest):
     text: str
 
-class ExtractRequest(BaseModel):
+    @field_validator("text")
+    @classmethod
+    def _text_nonempty(cls, v: str) -> str:
+        return require_content(v, "No text provided")
+
+
+class ExtractRequest(NLPRequest):
     text: str
     user_id: Optional[str] = "default"
 
+    @field_validator("text")
+    @classmethod
+    def _text_nonempty(cls, v: str) -> str:
+        return require_content(v, "No text provided")
 
-# ─── Endpoints ───────────────────────────────────────────────────────────────
 
-@app.get("/health")
-async def health():
-    return {
-        "status": "ok",
-        "service": "nlp-engine",
-        "version": "3.0.0",
-        "model": "perplexity-sonar-pro",
-        "endpoints": ["/process", "/ask", "/summarize", "/extract"]
-    }
+@app.exception_handler(RequestValidationError)
+async def empty_field_handler(request: Request, exc: RequestValidationError):
+    """Keep the 400 "No text provided"-style responses for empty fields."""
+    for error in exc.errors():
+        if error.get("type") == EMPTY_FIELD_ERROR:
+            return ORJSONResponse(status_code=400, content={"detail": error["msg"]})
+    return await request_validation_exception_handler(request, exc)
+
+
+# ─── Response Cache ─────────────────────────────────────────────────────────
+#
+# Two tiers: a process-local TTL cache, backed by Redis when REDIS_URL is set
+# so results are shared across workers. Keys hash (endpoint, params, text).
+
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "1024"))
+REDIS_URL = os.getenv("REDIS_URL", "")
 
+_local_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL_SECONDS)
+_redis = aioredis.from_url(REDIS_URL) if HAS_REDIS and REDIS_URL else None
 
-@app.post("/process")
-async def process_text_endpoint(request: ProcessRequest):
-    """Simplify a document into page-by-page summaries."""
-    if not request.text.strip():
-        raise HTTPException(status_code=400, detail="No text provided")
+
+def cache_key(endpoint: str, *parts: str) -> str:
+    # Keys are shared through Redis, so stay with a cryptographic hash;
+    # BLAKE3 is SIMD/multi-threaded and releases the GIL on large documents.
+    hasher = blake3(max_threads=blake3.AUTO) if HAS_BLAKE3 else hashlib.blake2b(digest_size=16)
+    hasher.update(endpoint.encode())
+    for part in parts:
+        hasher.update(b"|")
+        hasher.update(part.encode())
+    return hasher.hexdigest(16) if HAS_BLAKE3 else hasher.hexdigest()
+
+
+async def cache_get(key: str) -> Optional[dict]:
+    if key in _local_cache:
+        return _local_cache[key]
+    if _redis is None:
+        return None
     try:
-        result = await process_document(
-            text=request.text,
-            audience=request.audience_level,
-            user_id=request.user_id or "default"
-        )
-        return result
+        raw = await _redis.get(key)
     except Exception as e:
-        print(f"[/process] Error: {e}")
-        return {
-            "pages": [{
-                "page_number": 1,
-                "title": "Summary",
-                "simplified_text": f"Processing error. Document excerpt:\n\n{request.text[:500]}",
-                "image_prompt": "An error notification icon"
-            }]
-        }
-
-
-@app.post("/ask")
-async def ask_endpoint(request: AskRequest):
-    """Ask a question about an uploaded document (RAG Q&A)."""
-    if not request.text.strip():
-        raise HTTPException(status_code=400, detail="No document text provided")
-    if not request.question.strip():
-        raise HTTPException(status_code=400, detail="No question provided")
+        log.warning("cache_error", op="GET", error=str(e))
+        return None
+    if raw is None:
+        return None
+    result = orjson.loads(raw)
+    _local_cache[key] = result
+    return result
+
+
+async def cache_set(key: str, result: dict) -> None:
+    _local_cache[key] = result
+    if _redis is None:
+        return
     try:
-        result = await ask_document(
-            text=request.text,
-            question=request.question,
-            user_id=request.user_id or "default"
-        )
-        return result
+        await _redis.setex(key, CACHE_TTL_SECONDS, orjson.dumps(result))
     except Exception as e:
-        print(f"[/ask] Error: {e}")
-        return {"success": False, "answer": f"Error: {str(e)}", "confidence": "low", "relevant_excerpt": ""}
+        log.warning("cache_error", op="SETEX", error=str(e))
+
+
+def cached_endpoint(endpoint: str, *fields: str):
+    """Serve repeated requests from the cache.
+
+    The key covers the endpoint, the named request fields and the text.
+    Error responses (``success: False``) and degraded fallback results
+    (``fallback: True``, built when the LLM gave nothing usable) are never
+    stored, so a brief upstream outage isn't pinned for CACHE_TTL_SECONDS.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            key = cache_key(endpoint, *(str(getattr(request, f)) for f in fields), request.text)
+            cached = await cache_get(key)
+            if cached is not None:
+                return cached
+            result = await handler(request)
+            if isinstance(result, dict) and result.get("success", True) and not result.get("fallback"):
+                await cache_set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+
+# ─── Request Batching ───────────────────────────────────────────────────────
+#
+# Concurrent /summarize and /extract calls arriving within a short window are
+# collected and dispatched together, so identical documents share one LLM call.
 
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = int(os.getenv("BATCH_MAX_WAIT_MS", "20"))
 
-@app.post("/summarize")
-async def summarize_endpoint(request: SummarizeRequest):
-    """Summarize text into a concise paragraph."""
-    if not request.text.strip():
-        raise HTTPException(status_code=400, detail="No text provided")
+
+class BatchQueue:
+    """Collect concurrent submissions and hand them to ``batch_fn`` as one list."""
+
+    def __init__(self, batch_fn: Callable[[list], Awaitable[list]],
+                 max_batch: int = BATCH_MAX_SIZE, max_wait_ms: int = BATCH_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight: set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without blocking collection of the next batch
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: list):
+        try:
+            results = await self.batch_fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+summarize_queue = BatchQueue(summarize_batch)
+extract_queue = BatchQueue(extract_batch)
+
+
+# ─── Backpressure ───────────────────────────────────────────────────────────
+#
+# At most MAX_IN_FLIGHT NLP requests run at once per worker; a request that
+# cannot get a slot within QUEUE_TIMEOUT seconds is rejected with 429 rather
+# than queueing behind the LLM and inflating everyone's latency.
+
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "32"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "0.05"))
+
+_slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+_in_flight = 0
+_waiting = 0
+
+
+async def backpressure():
+    """Dependency holding one in-flight slot for the duration of the request."""
+    global _in_flight, _waiting
+    _waiting += 1
     try:
-        result = await summarize_text(text=request.text)
-        return result
-    except Exception as e:
-        print(f"[/summarize] Error: {e}")
-        return {"success": False, "summary": f"Error: {str(e)}", "word_count": 0, "key_topics": []}
+        await asyncio.wait_for(_slots.acquire(), QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=429, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    finally:
+        _waiting -= 1
+
+    _in_flight += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+        _slots.release()
+
+
+# ─── Endpoints ───────────────────────────────────────────────────────────────
+
+HEALTH_BYTES = orjson.dumps({
+    "status": "ok",
+    "service": "nlp-engine",
+    "version": "3.0.0",
+    "model": "perplexity-sonar-pro",
+    "endpoints": ["/process", "/ask", "/summarize", "/extract"],
+    "stream_endpoints": list(STREAM_ENDPOINTS)
+})
+HEALTH_ETAG = f'"{hashlib.blake2b(HEALTH_BYTES, digest_size=8).hexdigest()}"'
+
+
+@app.get("/health")
+async def health(request: Request):
+    # Body never changes at runtime, so probes can revalidate with If-None-Match;
+    # live load is reported in headers instead
+    headers = {"ETag": HEALTH_ETAG, "X-In-Flight": str(_in_flight), "X-Queue-Depth": str(_waiting)}
+    if request.headers.get("if-none-match") == HEALTH_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(content=HEALTH_BYTES, media_type="application/json", headers=headers)
+
+
+def make_handler(endpoint: str, request_model: type[NLPRequest],
+                 call: Callable[[Any], Awaitable[dict]],
+                 error_response: Callable[[Any, Exception], dict],
+                 cache_fields: tuple[str, ...] = (), doc: str = "", name: str = ""):
+    """
+    Build a JSON NLP endpoint: cached, with errors logged and turned into
+    the endpoint's error-shaped response instead of a 500.
+    """
+    @cached_endpoint(endpoint, *cache_fields)
+    async def handler(request: request_model):
+        try:
+            return await call(request)
+        except Exception as e:
+            log.exception("endpoint_error", endpoint=endpoint)
+            return error_response(request, e)
+
+    # The function name becomes the OpenAPI operationId, so keep it stable
+    handler.__name__ = handler.__qualname__ = name or endpoint.strip("/") + "_endpoint"
+    handler.__doc__ = doc
+    return handler
+
+
+def process_error_response(request: ProcessRequest, error: Exception) -> dict:
+    return {
+        "success": False,
+        "pages": [{
+            "page_number": 1,
+            "title": "Summary",
+            "simplified_text": f"Processing error. Document excerpt:\n\n{request.preview}",
+            "image_prompt": "An error notification icon"
+        }]
+    }
+
 
+def ask_error_response(request: AskRequest, error: Exception) -> dict:
+    return {"success": False, "answer": f"Error: {str(error)}", "confidence": "low", "relevant_excerpt": ""}
 
-@app.post("/extract")
-async def extract_endpoint(request: ExtractRequest):
-    """Extract key points from a document."""
-    if not request.text.strip():
-        raise HTTPException(status_code=400, detail="No text provided")
+
+def summarize_error_response(request: SummarizeRequest, error: Exception) -> dict:
+    return {"success": False, "summary": f"Error: {str(error)}", "word_count": 0, "key_topics": []}
+
+
+def extract_error_response(request: ExtractRequest, error: Exception) -> dict:
+    return {"success": False, "key_points": [], "overall_theme": f"Error: {str(error)}", "action_items": []}
+
+
+app.post("/process", dependencies=[Depends(backpressure)])(make_handler(
+    "/process", ProcessRequest,
+    lambda r: process_document(text=r.text, audience=r.audience_level, user_id=r.user_id or "default"),
+    process_error_response,
+    cache_fields=("audience_level",),
+    doc="Simplify a document into page-by-page summaries.",
+    name="process_text_endpoint",
+))
+
+app.post("/ask", dependencies=[Depends(backpressure)])(make_handler(
+    "/ask", AskRequest,
+    lambda r: ask_document(text=r.text, question=r.question, user_id=r.user_id or "default"),
+    ask_error_response,
+    cache_fields=("question",),
+    doc="Ask a question about an uploaded document (RAG Q&A).",
+))
+
+app.post("/summarize", dependencies=[Depends(backpressure)])(make_handler(
+    "/summarize", SummarizeRequest,
+    lambda r: summarize_queue.submit(r.text),
+    summarize_error_response,
+    doc="Summarize text into a concise paragraph.",
+))
+
+app.post("/extract", dependencies=[Depends(backpressure)])(make_handler(
+    "/extract", ExtractRequest,
+    lambda r: extract_queue.submit((r.text, r.user_id or "default")),
+    extract_error_response,
+    doc="Extract key points from a document.",
+))
+
+
+# ─── Streaming Endpoints (Server-Sent Events) ───────────────────────────────
+#
+# Same request bodies as the JSON endpoints above, but tokens are pushed to the
+# client as Perplexity generates them: one `data: {"token": ...}` event per
+# delta, then a terminal `data: {"done": true}` event.
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_frame(event: dict) -> bytes:
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+
+async def token_stream(events: AsyncIterator[dict], endpoint: str) -> AsyncIterator[bytes]:
+    """Encode nlp_engine stream events as SSE frames."""
     try:
-        result = await extract_key_points(
+        async for event in events:
+            yield sse_frame(event)
+    except Exception as e:
+        log.exception("stream_error", endpoint=endpoint)
+        yield sse_frame({"error": str(e)})
+    yield sse_frame({"done": True})
+
+
+def sse_response(events: AsyncIterator[dict], endpoint: str) -> StreamingResponse:
+    return StreamingResponse(
+        token_stream(events, endpoint),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@app.post("/process/stream")
+async def process_stream_endpoint(request: ProcessRequest):
+    """Stream page-by-page simplification tokens as SSE."""
+    return sse_response(process_document_stream(
+        text=request.text,
+        audience=request.audience_level,
+        user_id=request.user_id or "default"
+    ), "/process/stream")
+
+
+@app.post("/process/pages")
+async def process_pages_endpoint(request: ProcessRequest):
+    """Stream simplified pages as NDJSON, one line per page as each completes."""
+    async def page_lines() -> AsyncIterator[bytes]:
+        async for page in process_document_iter(
             text=request.text,
+            audience=request.audience_level,
             user_id=request.user_id or "default"
-        )
-        return result
-    except Exception as e:
-        print(f"[/extract] Error: {e}")
-        return {"success": False, "key_points": [], "overall_theme": f"Error: {str(e)}", "action_items": []}
+        ):
+            yield orjson.dumps(page) + b"\n"
+
+    return StreamingResponse(page_lines(), media_type="application/x-ndjson", headers=SSE_HEADERS)
+
+
+@app.post("/ask/stream")
+async def ask_stream_endpoint(request: AskRequest):
+    """Stream a RAG Q&A answer as SSE."""
+    return sse_response(ask_document_stream(
+        text=request.text,
+        question=request.question,
+        user_id=request.user_id or "default"
+    ), "/ask/stream")
+
+
+@app.post("/summarize/stream")
+async def summarize_stream_endpoint(request: SummarizeRequest):
+    """Stream a concise summary as SSE."""
+    return sse_response(summarize_text_stream(text=request.text), "/summarize/stream")
+
+
+@app.post("/extract/stream")
+async def extract_stream_endpoint(request: ExtractRequest):
+    """Stream key-point extraction as SSE."""
+    return sse_response(extract_key_points_stream(
+        text=request.text,
+        user_id=request.user_id or "default"
+    ), "/extract/stream")
 
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop/httptools come with uvicorn[standard]; uvloop is not available on Windows
+    has_uvloop = importlib.util.find_spec("uvloop") is not None
+    has_httptools = importlib.util.find_spec("httptools") is not None
+    # Workers need an import string; WEB_CONCURRENCY matches gunicorn_conf.py
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1)),
+        loop="uvloop" if has_uvloop else "asyncio",
+        http="httptools" if has_httptools else "h11",
+    )
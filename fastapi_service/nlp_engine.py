@@ -11,82 +11,300 @@ Flow:
 
 import os
 import re
+import shutil
+import tempfile
 import json
 import asyncio
-import sys
-import traceback
+import functools
+import orjson
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-# Fix Windows console encoding for emoji/unicode in log messages
-if sys.stdout and hasattr(sys.stdout, 'reconfigure'):
-    try:
-        sys.stdout.reconfigure(encoding='utf-8', errors='replace')
-    except Exception:
-        pass
-if sys.stderr and hasattr(sys.stderr, 'reconfigure'):
-    try:
-        sys.stderr.reconfigure(encoding='utf-8', errors='replace')
-    except Exception:
-        pass
+import numpy as np
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+log = logging.getLogger("nlp_engine")
+
 # ─── Imports with try/except guards ─────────────────────────────────────────
 
 try:
     from langchain_text_splitters import RecursiveCharacterTextSplitter
     HAS_LANGCHAIN = True
-    print("✅ LangChain text splitters loaded")
+    log.info("✅ LangChain text splitters loaded")
 except ImportError as e:
     HAS_LANGCHAIN = False
-    print(f"⚠️  LangChain text splitters unavailable: {e}")
+    log.warning("⚠️  LangChain text splitters unavailable: %s", e)
 
 try:
-    from langchain_community.vectorstores import FAISS
+    import faiss
     HAS_FAISS = True
-    print("✅ FAISS vector store loaded")
+    log.info("✅ FAISS loaded")
 except ImportError as e:
     HAS_FAISS = False
-    print(f"⚠️  FAISS unavailable: {e}")
+    log.warning("⚠️  FAISS unavailable: %s", e)
 
 try:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    Embeddings = object
+
+try:
+    import torch
+    from sentence_transformers import SentenceTransformer
     HAS_EMBEDDINGS = True
-    print("✅ HuggingFace embeddings loaded")
+    log.info("✅ Sentence-Transformers embeddings loaded")
 except ImportError as e:
     HAS_EMBEDDINGS = False
-    print(f"⚠️  HuggingFace embeddings unavailable: {e}")
+    log.warning("⚠️  Sentence-Transformers embeddings unavailable: %s", e)
 
 try:
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+    HAS_ONNX = True
+    log.info("✅ ONNX Runtime embeddings loaded")
+except ImportError as e:
+    HAS_ONNX = False
+    log.warning("⚠️  ONNX Runtime embeddings unavailable: %s", e)
+
+try:
+    import httpx
+    import openai
     from openai import AsyncOpenAI
     HAS_OPENAI = True
-    print("✅ OpenAI client loaded (for Perplexity)")
+    log.info("✅ OpenAI client loaded (for Perplexity)")
 except ImportError as e:
     HAS_OPENAI = False
-    print(f"⚠️  OpenAI client unavailable: {e}")
+    log.warning("⚠️  OpenAI client unavailable: %s", e)
+
+try:
+    import xxhash
+    HAS_XXHASH = True
+except ImportError as e:
+    HAS_XXHASH = False
+    log.warning("⚠️  xxhash unavailable, fingerprinting documents with blake2b: %s", e)
+
+try:
+    import diskcache
+    HAS_DISKCACHE = True
+except ImportError as e:
+    HAS_DISKCACHE = False
+    log.warning("⚠️  diskcache unavailable, chunk embeddings will not be cached: %s", e)
+
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError as e:
+    HAS_TIKTOKEN = False
+    log.warning("⚠️  tiktoken unavailable, prompts will be trimmed by characters: %s", e)
+
+try:
+    from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+    HAS_TENACITY = True
+except ImportError as e:
+    HAS_TENACITY = False
+    log.warning("⚠️  tenacity unavailable, Perplexity calls will not be retried: %s", e)
 
 # ─── Config ──────────────────────────────────────────────────────────────────
 
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY", "")
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+PERPLEXITY_MODEL = "sonar-pro"
+# Max pages of one document simplified concurrently (cf. OLLAMA_NUM_PARALLEL)
+LLM_MAX_PARALLEL = int(os.getenv("LLM_MAX_PARALLEL", "8"))
+# Max Perplexity completions in flight per worker, across all requests
+PPLX_CONCURRENCY = int(os.getenv("PPLX_CONCURRENCY", "8"))
 VECTOR_STORE_DIR = Path(__file__).parent / "vector_stores"
 
 try:
     VECTOR_STORE_DIR.mkdir(exist_ok=True)
-    print(f"✅ Vector store directory: {VECTOR_STORE_DIR}")
+    log.info("✅ Vector store directory: %s", VECTOR_STORE_DIR)
 except Exception as e:
-    print(f"⚠️  Could not create vector store directory: {e}")
+    log.warning("⚠️  Could not create vector store directory: %s", e)
+
+# ─── Precompiled Patterns ────────────────────────────────────────────────────
+
+_PAGE_SPLIT_RE = re.compile(r'\n\s*---\s*\n|\f|\n\s*Page\s+\d+\s*\n', re.IGNORECASE)
+_USER_ID_SAFE_RE = re.compile(r'[^a-zA-Z0-9_\-]')
+_MD_FENCE_OPEN_RE = re.compile(r'^```(?:json)?\s*')
+_MD_FENCE_CLOSE_RE = re.compile(r'\s*```$')
+_SENT_SPLIT_RE = re.compile(r'[.!?]+')
+_MOCK_TITLE_STRIP_RE = re.compile(r'^[#\-*>\d.]+\s*')
 
 # ─── Embedding Model (lazy-loaded singleton) ────────────────────────────────
 
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# onnx: INT8-quantized ONNX Runtime session (VNNI on capable CPUs); torch: SentenceTransformer
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+# float32 | bfloat16 | float16 (torch backend) — MiniLM on CPU is memory-bound,
+# so halving the weight bytes speeds up the matmuls; bfloat16 keeps float32's range.
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "bfloat16")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MAX_LENGTH = 256
+ONNX_MODEL_DIR = Path(__file__).parent / "onnx_models"
+
 _embeddings = None
 _embeddings_init_attempted = False
 
 
+class _SortedBatchEmbeddings(Embeddings):
+    """
+    LangChain Embeddings base that tokenizes all texts in one call, sorts them
+    by length and encodes them in padded batches, so short chunks aren't
+    padded out to the longest one. Subclasses implement _embed_batch().
+    """
+
+    tokenizer = None
+    batch_size = EMBEDDING_BATCH_SIZE
+    max_length = EMBEDDING_MAX_LENGTH
+    pad_tensors = "np"
+
+    def _embed_batch(self, batch) -> "np.ndarray":
+        """Return float32 L2-normalized mean-pooled vectors for one padded batch."""
+        raise NotImplementedError
+
+    def _encode(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        ids = encoded["input_ids"]
+        order = sorted(range(len(texts)), key=lambda i: len(ids[i]), reverse=True)
+
+        vectors = None
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            batch = self.tokenizer.pad(
+                {key: [encoded[key][i] for i in idx] for key in encoded.keys()},
+                return_tensors=self.pad_tensors,
+            )
+            pooled = self._embed_batch(batch)
+            if vectors is None:
+                vectors = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            vectors[idx] = pooled
+        return vectors.tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._encode(list(texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._encode([text])[0]
+
+
+if HAS_EMBEDDINGS:
+    class MiniLMEmbeddings(_SortedBatchEmbeddings):
+        """
+        SentenceTransformer loaded in reduced precision. Mean pooling and L2
+        normalization happen in float32 to avoid bf16/fp16 reduction error.
+        """
+
+        pad_tensors = "pt"
+
+        def __init__(self, model_name: str = EMBEDDING_MODEL_NAME,
+                     dtype: str = EMBEDDING_DTYPE, device: str = "cpu",
+                     batch_size: int = EMBEDDING_BATCH_SIZE):
+            self.model = SentenceTransformer(model_name, device=device)
+            self.model.to(getattr(torch, dtype))
+            self.model.eval()
+            self.tokenizer = self.model.tokenizer
+            self.transformer = self.model[0].auto_model
+            self.max_length = self.model.max_seq_length
+            self.batch_size = batch_size
+
+        def _embed_batch(self, batch) -> "np.ndarray":
+            with torch.inference_mode():
+                batch = batch.to(self.transformer.device)
+                hidden = self.transformer(**batch).last_hidden_state.float()
+                mask = batch["attention_mask"].unsqueeze(-1).float()
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                return torch.nn.functional.normalize(pooled, p=2, dim=1).cpu().numpy()
+
+
+if HAS_ONNX:
+    class OnnxMiniLMEmbeddings(_SortedBatchEmbeddings):
+        """
+        MiniLM exported to ONNX and dynamically quantized to INT8 (AVX-512
+        VNNI config), run on a single CPU InferenceSession. The export is done
+        once and cached under ONNX_MODEL_DIR; pooling is done in NumPy.
+        """
+
+        QUANTIZED_FILE = "model_quantized.onnx"
+
+        def __init__(self, model_name: str = EMBEDDING_MODEL_NAME,
+                     batch_size: int = EMBEDDING_BATCH_SIZE):
+            model_dir = ONNX_MODEL_DIR / _USER_ID_SAFE_RE.sub('_', model_name)
+            if not (model_dir / self.QUANTIZED_FILE).exists():
+                self._export_quantized(model_name, model_dir)
+
+            self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.session = ort.InferenceSession(
+                str(model_dir / self.QUANTIZED_FILE), options,
+                providers=["CPUExecutionProvider"]
+            )
+            self.input_names = {i.name for i in self.session.get_inputs()}
+            self.batch_size = batch_size
+
+        @classmethod
+        def _export_quantized(cls, model_name: str, model_dir: Path) -> None:
+            """
+            Export into a private temp dir and rename it into place, so workers
+            exporting at the same time never see each other's half-written files.
+            """
+            source = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+            log.info("🔄 Exporting %s to INT8 ONNX (one-time)...", source)
+            ONNX_MODEL_DIR.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(prefix=".export-", dir=ONNX_MODEL_DIR))
+            try:
+                ORTModelForFeatureExtraction.from_pretrained(source, export=True).save_pretrained(tmp_dir)
+                AutoTokenizer.from_pretrained(source).save_pretrained(tmp_dir)
+                quantizer = ORTQuantizer.from_pretrained(tmp_dir)
+                quantizer.quantize(
+                    save_dir=tmp_dir,
+                    quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False),
+                )
+                if model_dir.exists() and not (model_dir / cls.QUANTIZED_FILE).exists():
+                    shutil.rmtree(model_dir, ignore_errors=True)  # left by an interrupted export
+                try:
+                    os.replace(tmp_dir, model_dir)
+                except OSError:
+                    if not (model_dir / cls.QUANTIZED_FILE).exists():
+                        raise
+                    log.info("ℹ️  Another worker finished the ONNX export first; using it")
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        def _embed_batch(self, batch) -> "np.ndarray":
+            feeds = {name: batch[name].astype(np.int64) for name in self.input_names if name in batch}
+            hidden = self.session.run(None, feeds)[0].astype(np.float32)
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+
+_embeddings_lock = threading.Lock()
+
+
 def get_embeddings():
     """Lazy-load the embedding model. Returns None if unavailable."""
+    if _embeddings is not None:
+        return _embeddings
+    # RAG steps run in worker threads; make sure only one of them loads the model
+    with _embeddings_lock:
+        return _load_embeddings()
+
+
+def _load_embeddings():
     global _embeddings, _embeddings_init_attempted
 
     if _embeddings is not None:
@@ -97,22 +315,26 @@ def get_embeddings():
 
     _embeddings_init_attempted = True
 
+    if EMBEDDING_BACKEND == "onnx" and HAS_ONNX:
+        try:
+            log.info("🔄 Loading INT8 ONNX embedding model (%s)...", EMBEDDING_MODEL_NAME)
+            _embeddings = OnnxMiniLMEmbeddings()
+            log.info("✅ Embedding model loaded successfully (ONNX Runtime)")
+            return _embeddings
+        except Exception as e:
+            log.warning("⚠️  ONNX embedding model failed, falling back to PyTorch: %s", e, exc_info=True)
+
     if not HAS_EMBEDDINGS:
-        print("⚠️  Skipping embeddings — HuggingFaceEmbeddings not installed")
+        log.warning("⚠️  Skipping embeddings — sentence-transformers not installed")
         return None
 
     try:
-        print("🔄 Loading embedding model (all-MiniLM-L6-v2)... this may take a moment on first run")
-        _embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2",
-            model_kwargs={"device": "cpu"},
-            encode_kwargs={"normalize_embeddings": True}
-        )
-        print("✅ Embedding model loaded successfully")
+        log.info("🔄 Loading embedding model (%s, %s)... this may take a moment on first run", EMBEDDING_MODEL_NAME, EMBEDDING_DTYPE)
+        _embeddings = MiniLMEmbeddings()
+        log.info("✅ Embedding model loaded successfully")
         return _embeddings
     except Exception as e:
-        print(f"❌ Failed to load embedding model: {e}")
-        traceback.print_exc()
+        log.exception("❌ Failed to load embedding model: %s", e)
         return None
 
 
@@ -120,13 +342,42 @@ def get_embeddings():
 # TEXT CHUNKING
 # ═══════════════════════════════════════════════════════════════════════════════
 
+def pack_paragraphs(text: str, max_chars: int) -> list[str]:
+    """
+    Greedily pack consecutive "\n\n"-separated paragraphs into pieces of at
+    most max_chars (a single longer paragraph becomes its own piece).
+
+    Works on paragraph offsets: a piece is one slice of the original text,
+    found with np.searchsorted over cumulative paragraph ends, instead of
+    being grown by repeated string concatenation.
+    """
+    lengths = np.fromiter(map(len, text.split("\n\n")), dtype=np.int64)
+    ends = np.cumsum(lengths + 2) - 2        # end offset of each paragraph
+    starts = ends - lengths
+
+    pieces = []
+    i, n = 0, len(lengths)
+    while i < n:
+        if not lengths[i]:          # empty paragraphs never open a piece
+            i += 1
+            continue
+        # First paragraph whose end would push this piece past max_chars
+        j = int(np.searchsorted(ends, starts[i] + max_chars + 2, side="right"))
+        j = max(j, i + 1)
+        piece = text[starts[i]:ends[j - 1]].strip()
+        if piece:
+            pieces.append(piece)
+        i = j
+    return pieces
+
+
 def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list[str]:
     """
     Split text into overlapping chunks using LangChain splitter.
     Falls back to simple splitting if LangChain is unavailable.
     """
     if not text or not text.strip():
-        print("⚠️  chunk_text: Empty text received, returning empty list")
+        log.warning("⚠️  chunk_text: Empty text received, returning empty list")
         return []
 
     try:
@@ -137,28 +388,17 @@ def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> l
                 separators=["\n\n", "\n", ". ", " ", ""]
             )
             chunks = splitter.split_text(text)
-            print(f"✅ Text chunked into {len(chunks)} chunks (LangChain)")
+            log.info("✅ Text chunked into %d chunks (LangChain)", len(chunks))
             return chunks
         else:
             # Fallback: simple paragraph-based splitting
-            print("⚠️  Using fallback chunking (no LangChain)")
-            paragraphs = text.split("\n\n")
-            chunks = []
-            current = ""
-            for para in paragraphs:
-                if len(current) + len(para) > chunk_size and current:
-                    chunks.append(current.strip())
-                    current = para
-                else:
-                    current += "\n\n" + para if current else para
-            if current.strip():
-                chunks.append(current.strip())
-            print(f"✅ Text chunked into {len(chunks)} chunks (fallback)")
+            log.warning("⚠️  Using fallback chunking (no LangChain)")
+            chunks = pack_paragraphs(text, chunk_size)
+            log.info("✅ Text chunked into %d chunks (fallback)", len(chunks))
             return chunks if chunks else [text]
 
     except Exception as e:
-        print(f"❌ Error during text chunking: {e}")
-        traceback.print_exc()
+        log.exception("❌ Error during text chunking: %s", e)
         # Last resort: return entire text as one chunk
         return [text]
 
@@ -169,26 +409,16 @@ def segment_pages(text: str, max_chars_per_page: int = 3000) -> list[str]:
         return [text or ""]
 
     try:
-        pages = re.split(r'\n\s*---\s*\n|\f|\n\s*Page\s+\d+\s*\n', text, flags=re.IGNORECASE)
+        pages = _PAGE_SPLIT_RE.split(text)
         pages = [p.strip() for p in pages if p.strip()]
         if len(pages) > 1:
             return pages
 
-        paragraphs = text.split('\n\n')
-        pages = []
-        current = ""
-        for para in paragraphs:
-            if len(current) + len(para) > max_chars_per_page and current:
-                pages.append(current.strip())
-                current = para
-            else:
-                current += "\n\n" + para if current else para
-        if current.strip():
-            pages.append(current.strip())
+        pages = pack_paragraphs(text, max_chars_per_page)
         return pages if pages else [text]
 
     except Exception as e:
-        print(f"❌ Error during page segmentation: {e}")
+        log.error("❌ Error during page segmentation: %s", e)
         return [text]
 
 
@@ -196,137 +426,437 @@ def segment_pages(text: str, max_chars_per_page: int = 3000) -> list[str]:
 # FAISS VECTOR STORE
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def build_vector_store(text: str, user_id: str = "default") -> Optional[object]:
+VECTOR_STORE_CACHE_SIZE = int(os.getenv("VECTOR_STORE_CACHE_SIZE", "32"))
+# Stores kept on disk per user; older documents' stores are deleted on rebuild
+VECTOR_STORES_PER_USER = int(os.getenv("VECTOR_STORES_PER_USER", "8"))
+
+# Below FLAT_MAX_VECTORS exact search is cheapest; up to HNSW_MAX_VECTORS an HNSW
+# graph gives ~O(log N) queries; beyond that IVF-PQ also compresses the vectors.
+FLAT_MAX_VECTORS = 1_000
+HNSW_MAX_VECTORS = 50_000
+
+
+class DocumentIndex:
+    """
+    Raw FAISS index over one document's chunks, plus the chunk texts by id.
+    Vectors are L2-normalized, so inner product == cosine similarity.
+
+    Vectors are stored as INT8 scalar-quantized codes (384 bytes instead of
+    1536 per MiniLM vector); very large documents use IVF-PQ instead.
+    """
+
+    INDEX_FILE = "chunks.faiss"
+    TEXTS_FILE = "chunks.json"
+    # faiss writes a four-byte type tag first; this one marks an IndexIVFPQ
+    IVFPQ_FOURCC = b"IwPQ"
+
+    def __init__(self, index, texts: list[str]):
+        self.index = index
+        self.texts = texts
+
+    @classmethod
+    def build(cls, vectors, texts: list[str]) -> "DocumentIndex":
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n, dim = vectors.shape
+        if n <= FLAT_MAX_VECTORS:
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit,
+                                               faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+        elif n <= HNSW_MAX_VECTORS:
+            index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, 32,
+                                      faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.hnsw.efSearch = 64
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(quantizer, dim, 256, 48, 8, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = 16
+        index.add(vectors)
+        return cls(index, list(texts))
+
+    def search(self, query_vectors, k: int) -> list[list[str]]:
+        """Return the top-k chunk texts for each query vector."""
+        queries = np.array(query_vectors, dtype=np.float32)
+        faiss.normalize_L2(queries)
+        _, ids = self.index.search(queries, min(k, len(self.texts)))
+        return [[self.texts[i] for i in row if i >= 0] for row in ids]
+
+    def save(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(self.index, str(path / self.INDEX_FILE))
+        (path / self.TEXTS_FILE).write_text(json.dumps(self.texts), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["DocumentIndex"]:
+        if not (path / cls.INDEX_FILE).exists() or not (path / cls.TEXTS_FILE).exists():
+            return None
+        index_file = str(path / cls.INDEX_FILE)
+        # IO_FLAG_MMAP only affects IVF inverted lists: for the IVF-PQ tier the
+        # PQ codes stay on disk and are paged in as searched. The flat / HNSW
+        # scalar-quantizer tiers are always read fully into RAM.
+        with open(index_file, "rb") as f:
+            is_ivf = f.read(4) == cls.IVFPQ_FOURCC
+        try:
+            index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP if is_ivf else 0)
+        except RuntimeError:
+            index = faiss.read_index(index_file)
+        texts = json.loads((path / cls.TEXTS_FILE).read_text(encoding="utf-8"))
+        return cls(index, texts)
+
+# (user_id, text_hash) → FAISS store, least recently used first
+_vector_store_cache: "OrderedDict[tuple[str, str], DocumentIndex]" = OrderedDict()
+# Guards the LRU and the per-document build locks below
+_vector_store_lock = threading.Lock()
+# (user_id, text_hash) → lock held while that store is loaded/built
+_vector_store_builds: dict[tuple[str, str], threading.Lock] = {}
+
+
+def text_fingerprint(text: str) -> str:
+    """
+    Stable hash of a document, used to key its vector store. xxh3 is a
+    non-cryptographic hash; that is fine here because stores are also scoped
+    by user_id, so a crafted collision could only clobber the caller's own.
+    """
+    data = text.encode("utf-8", "ignore")
+    if HAS_XXHASH:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _store_path(user_id: str, text_hash: str = "") -> Path:
+    # Sanitize user_id for filesystem safety
+    safe_user_id = _USER_ID_SAFE_RE.sub('_', user_id)
+    return VECTOR_STORE_DIR / (f"{safe_user_id}_{text_hash}" if text_hash else safe_user_id)
+
+
+def _prune_user_stores(user_id: str) -> None:
+    """Delete all but the VECTOR_STORES_PER_USER most recently written stores of a user."""
+    safe_user_id = _USER_ID_SAFE_RE.sub('_', user_id)
+    # Exact match on "<user>_<32 hex>", so user "a" never matches user "a_b"'s stores
+    pattern = re.compile(re.escape(safe_user_id) + r"_[0-9a-f]{32}")
+    stores = []
+    for path in VECTOR_STORE_DIR.glob(f"{safe_user_id}_*"):
+        if pattern.fullmatch(path.name):
+            try:
+                stores.append((path.stat().st_mtime, path))
+            except OSError:
+                pass  # removed by another worker meanwhile
+    stores.sort(reverse=True)
+    for _, path in stores[VECTOR_STORES_PER_USER:]:
+        shutil.rmtree(path, ignore_errors=True)
+        log.info("🧹 Removed old FAISS index %s", path)
+
+
+def _cached_vector_store(key: tuple[str, str]) -> Optional[DocumentIndex]:
+    with _vector_store_lock:
+        vector_store = _vector_store_cache.get(key)
+        if vector_store is not None:
+            _vector_store_cache.move_to_end(key)
+        return vector_store
+
+
+def get_or_build_vector_store(text: str, user_id: str = "default",
+                              text_hash: Optional[str] = None) -> Optional[DocumentIndex]:
+    """
+    Return the FAISS store for this user's document, reusing work where possible:
+    in-memory LRU → index persisted on disk → chunk + embed from scratch.
+
+    Thread-safe: concurrent calls for the same document wait for a single build.
+    """
+    text_hash = text_hash or text_fingerprint(text)
+    key = (user_id, text_hash)
+
+    vector_store = _cached_vector_store(key)
+    if vector_store is not None:
+        log.info("♻️  Reusing cached FAISS index for user '%s'", user_id)
+        return vector_store
+
+    with _vector_store_lock:
+        build_lock = _vector_store_builds.setdefault(key, threading.Lock())
+
+    with build_lock:
+        vector_store = _cached_vector_store(key)
+        if vector_store is not None:
+            log.info("♻️  Reusing FAISS index built by a concurrent request for user '%s'", user_id)
+            return vector_store
+
+        try:
+            vector_store = load_vector_store(user_id, text_hash)
+            if vector_store is None:
+                vector_store = build_vector_store(text, user_id, text_hash)
+            if vector_store is not None:
+                with _vector_store_lock:
+                    _vector_store_cache[key] = vector_store
+                    if len(_vector_store_cache) > VECTOR_STORE_CACHE_SIZE:
+                        _vector_store_cache.popitem(last=False)
+        finally:
+            with _vector_store_lock:
+                _vector_store_builds.pop(key, None)
+    return vector_store
+
+
+# Content-addressed chunk embeddings, shared by every worker and document, so
+# re-uploading an edited document only embeds the chunks that changed. The
+# leading dot keeps the directory name out of reach of sanitized user ids.
+CHUNK_VECTOR_CACHE_DIR = VECTOR_STORE_DIR / ".chunk_vectors"
+CHUNK_VECTOR_CACHE_BYTES = 512 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=1)
+def _chunk_vector_cache():
+    if not HAS_DISKCACHE:
+        return None
+    try:
+        return diskcache.Cache(str(CHUNK_VECTOR_CACHE_DIR), size_limit=CHUNK_VECTOR_CACHE_BYTES)
+    except Exception as e:
+        log.warning("⚠️  Could not open chunk embedding cache: %s", e)
+        return None
+
+
+def _chunk_vector_key(data: str) -> str:
+    # The cache is shared across users, so unlike text_fingerprint this must be
+    # collision resistant: otherwise one user could plant vectors for another's chunks
+    return "b2:" + hashlib.blake2b(data.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def embed_chunks(embeddings, chunks: list[str]) -> "np.ndarray":
+    """
+    Embed chunks, reusing vectors cached by chunk content. Only cache misses
+    (deduplicated) go through the model. Returns a float32 (n, dim) array.
+    """
+    cache = _chunk_vector_cache()
+    if cache is None:
+        return np.asarray(embeddings.embed_documents(chunks), dtype=np.float32)
+
+    # Vectors differ between models/backends, so they're part of the key
+    model_id = f"{type(embeddings).__name__}:{EMBEDDING_MODEL_NAME}:{EMBEDDING_DTYPE}\0"
+    keys = [_chunk_vector_key(model_id + chunk) for chunk in chunks]
+
+    vectors = [None] * len(chunks)
+    try:
+        for i, key in enumerate(keys):
+            raw = cache.get(key)
+            if raw is not None:
+                vectors[i] = np.frombuffer(raw, dtype=np.float32)
+    except Exception as e:
+        log.warning("⚠️  Chunk embedding cache read failed: %s", e)
+        vectors = [None] * len(chunks)
+
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+    fresh = {}
+    if misses:
+        pending = list(dict.fromkeys(keys[i] for i in misses))
+        texts = {keys[i]: chunks[i] for i in misses}
+        fresh = dict(zip(pending, np.asarray(
+            embeddings.embed_documents([texts[key] for key in pending]), dtype=np.float32
+        )))
+        for i in misses:
+            vectors[i] = fresh[keys[i]]
+        try:
+            with cache.transact():
+                for key, vector in fresh.items():
+                    cache.set(key, vector.tobytes())
+        except Exception as e:
+            log.warning("⚠️  Chunk embedding cache write failed: %s", e)
+
+    log.info("🧮 Embedded %d of %d chunks (%d reused from cache)",
+             len(fresh), len(chunks), len(chunks) - len(misses))
+    return np.vstack(vectors)
+
+
+def build_vector_store(text: str, user_id: str = "default",
+                       text_hash: Optional[str] = None) -> Optional[DocumentIndex]:
     """
     Chunk the text, embed it, and store in FAISS.
     Returns the vector store object, or None if anything fails.
+    Prefer get_or_build_vector_store(), which reuses existing indexes.
     """
     if not HAS_FAISS:
-        print("⚠️  build_vector_store: FAISS not available, skipping")
+        log.warning("⚠️  build_vector_store: FAISS not available, skipping")
         return None
 
     embeddings = get_embeddings()
     if embeddings is None:
-        print("⚠️  build_vector_store: No embedding model, skipping vector store")
+        log.warning("⚠️  build_vector_store: No embedding model, skipping vector store")
         return None
 
     try:
         # Step 1: Chunk the text
         chunks = chunk_text(text)
         if not chunks:
-            print("⚠️  build_vector_store: No chunks produced from text")
+            log.warning("⚠️  build_vector_store: No chunks produced from text")
             return None
 
-        print(f"📦 Building FAISS index with {len(chunks)} chunks for user '{user_id}'...")
+        log.info("📦 Building FAISS index with %d chunks for user '%s'...", len(chunks), user_id)
 
-        # Step 2: Create FAISS index from chunks
+        # Step 2: Embed all chunks in one batched pass, then index them
         try:
-            vector_store = FAISS.from_texts(chunks, embeddings)
-            print(f"✅ FAISS index built successfully ({len(chunks)} vectors)")
+            vectors = embed_chunks(embeddings, chunks)
+            vector_store = DocumentIndex.build(vectors, chunks)
+            log.info("✅ FAISS index built successfully (%d vectors)", len(chunks))
         except Exception as e:
-            print(f"❌ Failed to create FAISS index from texts: {e}")
-            traceback.print_exc()
+            log.exception("❌ Failed to create FAISS index from texts: %s", e)
             return None
 
-        # Step 3: Persist to disk (per-user)
+        # Step 3: Persist to disk (per user and document)
         try:
-            # Sanitize user_id for filesystem safety
-            safe_user_id = re.sub(r'[^a-zA-Z0-9_\-]', '_', user_id)
-            store_path = VECTOR_STORE_DIR / safe_user_id
-            vector_store.save_local(str(store_path))
-            print(f"💾 FAISS index saved to {store_path}")
+            store_path = _store_path(user_id, text_hash or text_fingerprint(text))
+            vector_store.save(store_path)
+            log.info("💾 FAISS index saved to %s", store_path)
+            _prune_user_stores(user_id)
         except Exception as e:
-            print(f"⚠️  Could not persist FAISS index to disk (still usable in memory): {e}")
+            log.warning("⚠️  Could not persist FAISS index to disk (still usable in memory): %s", e)
             # Non-fatal — we can still use the in-memory store
 
         return vector_store
 
     except Exception as e:
-        print(f"❌ Unexpected error building vector store: {e}")
-        traceback.print_exc()
+        log.exception("❌ Unexpected error building vector store: %s", e)
         return None
 
 
-def load_vector_store(user_id: str = "default") -> Optional[object]:
-    """Load an existing FAISS store for a user from disk."""
+def load_vector_store(user_id: str = "default", text_hash: str = "") -> Optional[DocumentIndex]:
+    """Load an existing FAISS store for a user (and document, if text_hash is given) from disk."""
     if not HAS_FAISS:
         return None
 
-    embeddings = get_embeddings()
-    if embeddings is None:
-        return None
-
     try:
-        safe_user_id = re.sub(r'[^a-zA-Z0-9_\-]', '_', user_id)
-        store_path = VECTOR_STORE_DIR / safe_user_id
-        if not store_path.exists():
-            print(f"ℹ️  No stored FAISS index for user '{user_id}'")
+        store_path = _store_path(user_id, text_hash)
+        vector_store = DocumentIndex.load(store_path)
+        if vector_store is None:
+            log.info("ℹ️  No stored FAISS index for user '%s'", user_id)
             return None
-
-        vector_store = FAISS.load_local(
-            str(store_path), embeddings,
-            allow_dangerous_deserialization=True
-        )
-        print(f"✅ Loaded FAISS index from {store_path}")
+        log.info("✅ Loaded FAISS index from %s", store_path)
+        if text_hash:
+            try:
+                os.utime(store_path)  # keep recently used stores out of _prune_user_stores' reach
+            except OSError:
+                pass
         return vector_store
     except Exception as e:
-        print(f"❌ Failed to load FAISS store for user '{user_id}': {e}")
-        traceback.print_exc()
+        log.exception("❌ Failed to load FAISS store for user '%s': %s", user_id, e)
         return None
 
 
-def retrieve_context(vector_store, query: str, k: int = 4) -> str:
-    """Retrieve the top-k most relevant chunks from FAISS for a given query."""
-    if vector_store is None:
-        return ""
+def retrieve_contexts(vector_store, queries: list[str], k: int = 4) -> list[str]:
+    """
+    Retrieve the top-k most relevant chunks for several queries at once:
+    one batched embedding pass and a single FAISS search over the stacked
+    query matrix. Returns one context string per query ("" on failure).
+    """
+    if vector_store is None or not queries:
+        return [""] * len(queries)
+
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return [""] * len(queries)
 
     try:
-        docs = vector_store.similarity_search(query, k=k)
-        context = "\n\n---\n\n".join([doc.page_content for doc in docs])
-        print(f"🔍 Retrieved {len(docs)} relevant chunks from FAISS")
-        return context
+        query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+        results = vector_store.search(query_vectors, k)
+        log.info("🔍 Retrieved %d relevant chunks from FAISS for %d queries", sum(len(r) for r in results), len(queries))
+        return ["\n\n---\n\n".join(chunks) for chunks in results]
     except Exception as e:
-        print(f"❌ FAISS retrieval error: {e}")
-        traceback.print_exc()
-        return ""
+        log.exception("❌ FAISS retrieval error: %s", e)
+        return [""] * len(queries)
+
+
+def retrieve_context(vector_store, query: str, k: int = 4) -> str:
+    """Retrieve the top-k most relevant chunks from FAISS for a given query."""
+    return retrieve_contexts(vector_store, [query], k)[0]
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # PERPLEXITY AI
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def get_audience_instructions(audience: str) -> str:
-    audiences = {
-        "executive": "Use very concise, high-level business language. Focus on ROI, strategic impact, and bottom-line results.",
-        "manager": "Use clear, simple English (Grade 6 level). Focus on project progress, team impact, and actionable items.",
-        "client": "Use professional but very simple language. Focus on deliverables, timelines, and value provided.",
-        "intern": "Use the simplest possible language. Explain every concept as if the reader has no technical background."
-    }
-    return audiences.get(audience.lower(), audiences["manager"])
+# Prompt budgets, in tokens. Without tiktoken they fall back to the old
+# character limits (PROMPT_CHARS_PER_TOKEN characters per token).
+SIMPLIFY_CONTEXT_TOKENS = 800
+ASK_CONTEXT_TOKENS = 1200
+SUMMARIZE_TEXT_TOKENS = 1600
+EXTRACT_TEXT_TOKENS = 2000
+PROMPT_CHARS_PER_TOKEN = 2.5
 
 
-def build_simplification_prompt(page_text: str, context: str, page_number: int, audience: str) -> str:
-    """Build the Perplexity prompt with RAG context."""
-    audience_instructions = get_audience_instructions(audience)
+# trim_to_tokens only tokenizes this many characters per token of budget, so
+# its cost is bounded by the budget rather than the document length
+TRIM_PREFIX_CHARS_PER_TOKEN = 8
+# After a failed encoding load, wait this long before trying again
+TOKEN_ENCODING_RETRY_SECONDS = 60
 
-    context_block = ""
-    if context:
-        context_block = f"""
+_token_encoding_loaded = None
+_token_encoding_lock = threading.Lock()
+_token_encoding_retry_at = 0.0
+
+
+def load_token_encoding():
+    """
+    Load the tiktoken encoding, downloading it on first use. Blocking: call it
+    at startup or from a worker thread. A failure is not remembered, so a
+    later call tries again.
+    """
+    global _token_encoding_loaded
+    if _token_encoding_loaded is not None or not HAS_TIKTOKEN:
+        return _token_encoding_loaded
+    try:
+        _token_encoding_loaded = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        log.warning("⚠️  Could not load tiktoken encoding, trimming by characters: %s", e)
+    return _token_encoding_loaded
+
+
+def _token_encoding():
+    """The loaded encoding, or None. Never blocks: a missing one is loaded in the background."""
+    global _token_encoding_retry_at
+    if _token_encoding_loaded is None and HAS_TIKTOKEN:
+        now = time.monotonic()
+        with _token_encoding_lock:
+            if now >= _token_encoding_retry_at:
+                _token_encoding_retry_at = now + TOKEN_ENCODING_RETRY_SECONDS
+                threading.Thread(target=load_token_encoding, name="tiktoken-load", daemon=True).start()
+    return _token_encoding_loaded
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens, on a token boundary."""
+    encoding = _token_encoding()
+    if encoding is None:
+        return text[:int(max_tokens * PROMPT_CHARS_PER_TOKEN)]
+    prefix = text[:max_tokens * TRIM_PREFIX_CHARS_PER_TOKEN]
+    ids = encoding.encode_ordinary(prefix)
+    if len(ids) <= max_tokens:
+        return prefix
+    return encoding.decode(ids[:max_tokens])
+
+
+_AUDIENCE_INSTRUCTIONS = {
+    "executive": "Use very concise, high-level business language. Focus on ROI, strategic impact, and bottom-line results.",
+    "manager": "Use clear, simple English (Grade 6 level). Focus on project progress, team impact, and actionable items.",
+    "client": "Use professional but very simple language. Focus on deliverables, timelines, and value provided.",
+    "intern": "Use the simplest possible language. Explain every concept as if the reader has no technical background."
+}
+
+
+def get_audience_instructions(audience: str) -> str:
+    return _AUDIENCE_INSTRUCTIONS.get(audience.lower(), _AUDIENCE_INSTRUCTIONS["manager"])
 
-Here is additional relevant context retrieved from the document:
----
-{context[:2000]}
----
-"""
 
+@functools.lru_cache(maxsize=8)
+def _prompt_prefix(audience: str) -> str:
+    """Header + audience block of the simplification prompt; identical for every page."""
     return f"""You are an expert business communication assistant.
 
 Task:
 Convert the following technical project update into a simplified executive summary.
 
 Audience: {audience.capitalize()}
-{audience_instructions}
-{context_block}
+{get_audience_instructions(audience)}
+"""
+
+
+_SIMPLIFY_RULES = """
 Rules:
 - Use very simple English (Grade 6 level).
 - Avoid technical jargon.
@@ -336,7 +866,22 @@ Rules:
 - Add a brief explanation of key impact.
 - Suggest a relevant image idea for this section.
 - Output format must be valid JSON:
+"""
+
+
+def build_simplification_prompt(page_text: str, context: str, page_number: int, audience: str) -> str:
+    """Build the Perplexity prompt with RAG context."""
+    context_block = ""
+    if context:
+        context_block = f"""
+
+Here is additional relevant context retrieved from the document:
+---
+{trim_to_tokens(context, SIMPLIFY_CONTEXT_TOKENS)}
+---
+"""
 
+    return f"""{_prompt_prefix(audience)}{context_block}{_SIMPLIFY_RULES}
 {{
   "page_number": {page_number},
   "title": "...",
@@ -352,43 +897,241 @@ Content to simplify:
 Respond ONLY with the JSON object, no other text."""
 
 
-async def call_perplexity(prompt: str, system_msg: str = "") -> str:
-    """Call Perplexity AI using its OpenAI-compatible API. Returns raw response text."""
+def _perplexity_ready(caller: str) -> bool:
+    """Check that the openai library and a usable API key are available."""
     if not HAS_OPENAI:
-        print("❌ call_perplexity: openai library not available")
-        return ""
+        log.error("❌ %s: openai library not available", caller)
+        return False
 
     if not PERPLEXITY_API_KEY or PERPLEXITY_API_KEY == "your_perplexity_api_key_here":
-        print("⚠️  call_perplexity: No valid Perplexity API key set")
+        log.warning("⚠️  %s: No valid Perplexity API key set", caller)
+        return False
+
+    return True
+
+
+_perplexity_client = None
+_owned_http_client = None
+
+
+def set_http_client(http_client) -> None:
+    """
+    Route Perplexity calls through a shared httpx.AsyncClient so connections
+    (and TLS sessions) are reused across requests. The caller owns the client
+    and must close it; pass None to fall back to the module's own pooled client.
+    """
+    global _perplexity_client
+    if http_client is None or not HAS_OPENAI:
+        _perplexity_client = None
+        return
+    _perplexity_client = AsyncOpenAI(
+        api_key=PERPLEXITY_API_KEY,
+        base_url=PERPLEXITY_BASE_URL,
+        http_client=http_client,
+        max_retries=0
+    )
+
+
+def _get_client():
+    """Return the shared AsyncOpenAI client, creating a pooled one on first use."""
+    global _perplexity_client, _owned_http_client
+    if _perplexity_client is not None:
+        return _perplexity_client
+    _owned_http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        timeout=60.0,
+    )
+    _perplexity_client = AsyncOpenAI(
+        api_key=PERPLEXITY_API_KEY,
+        base_url=PERPLEXITY_BASE_URL,
+        http_client=_owned_http_client,
+        max_retries=0
+    )
+    return _perplexity_client
+
+
+async def close_http_client() -> None:
+    """Close the pooled client created by _get_client() (call on shutdown)."""
+    global _perplexity_client, _owned_http_client
+    if _owned_http_client is None:
+        return
+    _perplexity_client = None
+    await _owned_http_client.aclose()
+    _owned_http_client = None
+
+
+def _build_messages(prompt: str, system_msg: str = "") -> list[dict]:
+    messages = []
+    if system_msg:
+        messages.append({"role": "system", "content": system_msg})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+class _JsonObjectScanner:
+    """
+    Incrementally tracks brace depth over streamed text (skipping string
+    literals) and records where the first top-level {...} object starts/ends.
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.start = -1
+        self.end = -1
+
+    def feed(self, chunk: str) -> bool:
+        """Consume the next piece of text. Returns True once the object is closed."""
+        for ch in chunk:
+            self.pos += 1
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                if self.depth:
+                    self.in_string = True
+            elif ch == "{":
+                if self.depth == 0:
+                    self.start = self.pos - 1
+                self.depth += 1
+            elif ch == "}" and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.pos
+                    return True
+        return False
+
+
+def find_json(s: str) -> Optional[str]:
+    """Return the first balanced top-level {...} object in s, nested ones included."""
+    scanner = _JsonObjectScanner()
+    if scanner.feed(s):
+        return s[scanner.start:scanner.end]
+    return None
+
+
+_PPLX_SEM = asyncio.Semaphore(PPLX_CONCURRENCY)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Rate limits, 5xx responses, timeouts and dropped connections are worth retrying."""
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError))
+
+
+def _with_retry(fn):
+    if not HAS_TENACITY:
+        return fn
+    return retry(
+        retry=retry_if_exception(_is_retryable),
+        wait=wait_exponential_jitter(initial=1, max=20),
+        stop=stop_after_attempt(4),
+        reraise=True,
+    )(fn)
+
+
+@_with_retry
+async def _complete_json(prompt: str, system_msg: str) -> str:
+    """
+    Stream one completion and close the request as soon as a balanced
+    top-level JSON object has arrived; that object is returned on its own.
+    """
+    stream = await _get_client().chat.completions.create(
+        model=PERPLEXITY_MODEL,
+        messages=_build_messages(prompt, system_msg),
+        temperature=0.5,
+        max_tokens=2000,
+        stream=True,
+    )
+    scanner = _JsonObjectScanner()
+    parts = []
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                if scanner.feed(delta):
+                    break
+    finally:
+        await stream.close()
+
+    result = "".join(parts)
+    if scanner.end != -1:
+        result = result[scanner.start:scanner.end]
+    return result.strip()
+
+
+async def call_perplexity(prompt: str, system_msg: str = "") -> str:
+    """
+    Call Perplexity AI using its OpenAI-compatible API. Returns raw response text.
+
+    At most PPLX_CONCURRENCY calls run at once; 429/5xx/timeouts are retried
+    with jittered exponential backoff before giving up.
+    """
+    if not _perplexity_ready("call_perplexity"):
         return ""
 
     try:
-        client = AsyncOpenAI(
-            api_key=PERPLEXITY_API_KEY,
-            base_url="https://api.perplexity.ai"
-        )
-
-        messages = []
-        if system_msg:
-            messages.append({"role": "system", "content": system_msg})
-        messages.append({"role": "user", "content": prompt})
-
-        response = await client.chat.completions.create(
-            model="sonar-pro",
-            messages=messages,
-            temperature=0.5,
-            max_tokens=2000,
-        )
-        result = response.choices[0].message.content.strip()
-        print(f"✅ Perplexity API returned {len(result)} chars")
+        async with _PPLX_SEM:
+            result = await _complete_json(prompt, system_msg)
+        log.info("✅ Perplexity API returned %d chars", len(result))
         return result
 
     except Exception as e:
-        print(f"❌ Perplexity API error: {type(e).__name__}: {e}")
-        traceback.print_exc()
+        log.exception("❌ Perplexity API error: %s: %s", type(e).__name__, e)
         return ""
 
 
+@_with_retry
+async def _open_stream(prompt: str, system_msg: str):
+    """Start a streamed completion; retried only until the response begins."""
+    return await _get_client().chat.completions.create(
+        model=PERPLEXITY_MODEL,
+        messages=_build_messages(prompt, system_msg),
+        temperature=0.5,
+        max_tokens=2000,
+        stream=True,
+    )
+
+
+async def stream_perplexity(prompt: str, system_msg: str = "") -> AsyncIterator[str]:
+    """Stream a Perplexity AI completion, yielding content deltas as they arrive.
+
+    Holds one of the PPLX_CONCURRENCY slots for the whole stream, like
+    call_perplexity. Yields nothing if the API is unavailable or the request
+    fails, so callers can fall back the same way they do for an empty
+    call_perplexity() result.
+    """
+    if not _perplexity_ready("stream_perplexity"):
+        return
+
+    try:
+        async with _PPLX_SEM:
+            stream = await _open_stream(prompt, system_msg)
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+            finally:
+                await stream.close()
+
+    except Exception as e:
+        log.exception("❌ Perplexity streaming error: %s: %s", type(e).__name__, e)
+
+
 def parse_llm_json(raw: str, page_number: int) -> dict:
     """Parse JSON from LLM response, handling markdown fences and edge cases."""
     if not raw:
@@ -396,20 +1139,20 @@ def parse_llm_json(raw: str, page_number: int) -> dict:
 
     try:
         # Remove markdown code fences if present
-        cleaned = re.sub(r'^```(?:json)?\s*', '', raw.strip())
-        cleaned = re.sub(r'\s*```$', '', cleaned)
+        cleaned = _MD_FENCE_OPEN_RE.sub('', raw.strip())
+        cleaned = _MD_FENCE_CLOSE_RE.sub('', cleaned)
 
-        result = json.loads(cleaned)
+        result = orjson.loads(cleaned.encode() if isinstance(cleaned, str) else cleaned)
         result["page_number"] = page_number
         return result
 
-    except json.JSONDecodeError as e:
-        print(f"⚠️  JSON parse failed for page {page_number}: {e}")
+    except orjson.JSONDecodeError as e:
+        log.warning("⚠️  JSON parse failed for page %s: %s", page_number, e)
         # Try to extract JSON from mixed text
         try:
-            json_match = re.search(r'\{[\s\S]*?\}', raw)
-            if json_match:
-                result = json.loads(json_match.group())
+            json_text = find_json(raw)
+            if json_text:
+                result = orjson.loads(json_text.encode())
                 result["page_number"] = page_number
                 return result
         except Exception:
@@ -424,7 +1167,7 @@ def parse_llm_json(raw: str, page_number: int) -> dict:
         }
 
     except Exception as e:
-        print(f"❌ Unexpected error parsing LLM JSON: {e}")
+        log.error("❌ Unexpected error parsing LLM JSON: %s", e)
         return {
             "page_number": page_number,
             "title": f"Section {page_number}",
@@ -442,11 +1185,11 @@ def generate_mock_response(page_text: str, page_number: int, audience: str) -> d
     try:
         lines = page_text.strip().split('\n')
         title_line = lines[0] if lines else "Section Summary"
-        title = re.sub(r'^[#\-*>\d.]+\s*', '', title_line)[:80]
+        title = _MOCK_TITLE_STRIP_RE.sub('', title_line)[:80]
         if not title:
             title = f"Section {page_number} Summary"
 
-        sentences = re.split(r'[.!?]+', page_text)
+        sentences = _SENT_SPLIT_RE.split(page_text)
         key_sentences = [s.strip() for s in sentences[:5] if len(s.strip()) > 20]
         simplified = "Here's what this section is about in simple terms:\n\n"
         for sent in key_sentences:
@@ -459,15 +1202,17 @@ def generate_mock_response(page_text: str, page_number: int, audience: str) -> d
             "page_number": page_number,
             "title": title,
             "simplified_text": simplified,
-            "image_prompt": "A team collaboration infographic showing project milestones"
+            "image_prompt": "A team collaboration infographic showing project milestones",
+            "fallback": True,
         }
     except Exception as e:
-        print(f"❌ Even mock response failed: {e}")
+        log.error("❌ Even mock response failed: %s", e)
         return {
             "page_number": page_number,
             "title": f"Section {page_number}",
             "simplified_text": "Could not process this section.",
-            "image_prompt": "A generic business infographic"
+            "image_prompt": "A generic business infographic",
+            "fallback": True,
         }
 
 
@@ -475,25 +1220,36 @@ def generate_mock_response(page_text: str, page_number: int, audience: str) -> d
 # MAIN PIPELINE
 # ═══════════════════════════════════════════════════════════════════════════════
 
+SIMPLIFY_SYSTEM_MSG = "You are a helpful assistant that simplifies technical documents. Always respond with valid JSON only."
+
+
+def _page_context(vector_store, page_text: str, page_number: int) -> str:
+    """Retrieve RAG context for a page, returning "" on any failure."""
+    if vector_store is None:
+        return ""
+    try:
+        return retrieve_context(vector_store, page_text, k=4)
+    except Exception as e:
+        log.warning("⚠️  Context retrieval failed for page %s: %s", page_number, e)
+        return ""
+
+
 async def simplify_page(page_text: str, page_number: int, audience: str,
-                        vector_store=None) -> dict:
-    """Simplify a single page using RAG context + Perplexity AI."""
+                        vector_store=None, context: Optional[str] = None) -> dict:
+    """
+    Simplify a single page using RAG context + Perplexity AI.
+    Pass a precomputed `context` to skip the per-page FAISS lookup.
+    """
     try:
         # 1. Retrieve relevant context from the FAISS vector store
-        context = ""
-        if vector_store is not None:
-            try:
-                context = retrieve_context(vector_store, page_text, k=4)
-            except Exception as e:
-                print(f"⚠️  Context retrieval failed for page {page_number}: {e}")
-                context = ""
+        if context is None:
+            context = await asyncio.to_thread(_page_context, vector_store, page_text, page_number)
 
         # 2. Build prompt with context
         prompt = build_simplification_prompt(page_text, context, page_number, audience)
-        system_msg = "You are a helpful assistant that simplifies technical documents. Always respond with valid JSON only."
 
         # 3. Call Perplexity AI
-        raw_response = await call_perplexity(prompt, system_msg)
+        raw_response = await call_perplexity(prompt, SIMPLIFY_SYSTEM_MSG)
 
         if raw_response:
             result = parse_llm_json(raw_response, page_number)
@@ -501,53 +1257,89 @@ async def simplify_page(page_text: str, page_number: int, audience: str,
                 return result
 
         # 4. Fallback to mock
-        print(f"⚠️  Using mock response for page {page_number}")
+        log.warning("⚠️  Using mock response for page %s", page_number)
         return generate_mock_response(page_text, page_number, audience)
 
     except Exception as e:
-        print(f"❌ Unexpected error simplifying page {page_number}: {e}")
-        traceback.print_exc()
+        log.exception("❌ Unexpected error simplifying page %s: %s", page_number, e)
         return generate_mock_response(page_text, page_number, audience)
 
 
-async def process_document(text: str, audience: str = "manager",
-                           user_id: str = "default") -> dict:
+async def _prepare_document(text: str, user_id: str) -> tuple[list[str], list[str]]:
     """
-    Full RAG pipeline:
-    1. Chunk text → FAISS vector store
-    2. Segment text into pages
-    3. For each page, retrieve context + call Perplexity AI
-    4. Return structured JSON
+    Build the vector store, segment display pages and retrieve every page's
+    RAG context in one batched search. Returns (pages, contexts).
+
+    The CPU-bound steps run in worker threads so the event loop keeps serving
+    other requests; building the store and segmenting pages run side by side.
     """
-    print(f"\n{'='*60}")
-    print(f"📝 Processing document for user '{user_id}' (audience: {audience})")
-    print(f"   Input length: {len(text)} chars")
-    print(f"{'='*60}")
+    store_result, pages_result = await asyncio.gather(
+        asyncio.to_thread(get_or_build_vector_store, text, user_id),
+        asyncio.to_thread(segment_pages, text),
+        return_exceptions=True,
+    )
 
     # Step 1: Build vector store from the full document
     vector_store = None
     try:
-        vector_store = build_vector_store(text, user_id)
+        if isinstance(store_result, BaseException):
+            raise store_result
+        vector_store = store_result
         if vector_store:
-            print("✅ Vector store ready for RAG retrieval")
+            log.info("✅ Vector store ready for RAG retrieval")
         else:
-            print("⚠️  Vector store unavailable — proceeding without RAG context")
+            log.warning("⚠️  Vector store unavailable — proceeding without RAG context")
     except Exception as e:
-        print(f"❌ Vector store build failed: {e}")
-        traceback.print_exc()
+        log.exception("❌ Vector store build failed: %s", e)
 
     # Step 2: Segment into display pages
     try:
-        pages = segment_pages(text)
-        print(f"📄 Document segmented into {len(pages)} pages")
+        if isinstance(pages_result, BaseException):
+            raise pages_result
+        pages = pages_result
+        log.info("📄 Document segmented into %d pages", len(pages))
     except Exception as e:
-        print(f"❌ Page segmentation failed: {e}")
+        log.error("❌ Page segmentation failed: %s", e)
         pages = [text]
 
-    # Step 3: Simplify each page concurrently
+    # Step 3: Retrieve context for all pages with a single FAISS search
+    contexts = await asyncio.to_thread(retrieve_contexts, vector_store, pages, k=4)
+
+    return pages, contexts
+
+
+def _bounded_simplifier(audience: str, contexts: list[str]):
+    """Return a simplify_page wrapper that allows LLM_MAX_PARALLEL concurrent pages."""
+    semaphore = asyncio.Semaphore(LLM_MAX_PARALLEL)
+
+    async def bounded_simplify(page: str, page_number: int) -> dict:
+        async with semaphore:
+            return await simplify_page(page, page_number, audience,
+                                       context=contexts[page_number - 1])
+
+    return bounded_simplify
+
+
+async def process_document(text: str, audience: str = "manager",
+                           user_id: str = "default") -> dict:
+    """
+    Full RAG pipeline:
+    1. Chunk text → FAISS vector store
+    2. Segment text into pages
+    3. Retrieve context for all pages in one batched FAISS search
+    4. For each page, call Perplexity AI with its context
+    5. Return structured JSON
+    """
+    log.info("📝 Processing document for user '%s' (audience: %s), %d chars", user_id, audience, len(text))
+
+    pages, contexts = await _prepare_document(text, user_id)
+
+    # Step 4: Simplify each page concurrently, at most LLM_MAX_PARALLEL at a time
+    bounded_simplify = _bounded_simplifier(audience, contexts)
+
     try:
         tasks = [
-            simplify_page(page, i + 1, audience, vector_store)
+            bounded_simplify(page, i + 1)
             for i, page in enumerate(pages)
         ]
         results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -556,73 +1348,135 @@ async def process_document(text: str, audience: str = "manager",
         final_results = []
         for i, result in enumerate(results):
             if isinstance(result, Exception):
-                print(f"❌ Page {i+1} processing raised exception: {result}")
+                log.error("❌ Page %s processing raised exception: %s", i + 1, result)
                 final_results.append(generate_mock_response(pages[i], i + 1, audience))
             else:
                 final_results.append(result)
 
-        print(f"\n✅ Processing complete: {len(final_results)} pages simplified")
-        return {"pages": final_results}
+        log.info("✅ Processing complete: %d pages simplified", len(final_results))
+        result = {"pages": final_results}
+        if any(page.get("fallback") for page in final_results):
+            result["fallback"] = True
+        return result
 
     except Exception as e:
-        print(f"❌ Critical error during document processing: {e}")
-        traceback.print_exc()
+        log.exception("❌ Critical error during document processing: %s", e)
         # Emergency fallback
         return {
             "pages": [
                 generate_mock_response(pages[i] if i < len(pages) else text, i + 1, audience)
                 for i in range(len(pages))
-            ]
+            ],
+            "fallback": True,
         }
 
 
+async def process_document_iter(text: str, audience: str = "manager",
+                                user_id: str = "default") -> AsyncIterator[dict]:
+    """
+    Yield simplified pages as soon as each one completes.
+
+    Pages arrive in completion order, not page order; each dict has the same
+    schema as an entry of process_document()["pages"], including page_number.
+    """
+    log.info("📝 Processing document page-by-page for user '%s' (audience: %s), %d chars", user_id, audience, len(text))
+
+    pages, contexts = await _prepare_document(text, user_id)
+    bounded_simplify = _bounded_simplifier(audience, contexts)
+
+    async def safe_simplify(page: str, page_number: int) -> dict:
+        try:
+            return await bounded_simplify(page, page_number)
+        except Exception as e:
+            log.error("❌ Page %s processing raised exception: %s", page_number, e)
+            return generate_mock_response(page, page_number, audience)
+
+    tasks = [
+        asyncio.ensure_future(safe_simplify(page, i + 1))
+        for i, page in enumerate(pages)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away mid-stream: don't keep paying for the remaining pages
+        for task in tasks:
+            task.cancel()
+
+
+async def process_document_stream(text: str, audience: str = "manager",
+                                  user_id: str = "default") -> AsyncIterator[dict]:
+    """
+    Streaming variant of process_document.
+
+    Pages are simplified in order; each Perplexity delta is yielded as
+    {"page_number", "token"}. A page that produces no tokens yields its mock
+    response, JSON-encoded, as a single token.
+    """
+    log.info("📝 Streaming document for user '%s' (audience: %s), %d chars", user_id, audience, len(text))
+
+    pages, contexts = await _prepare_document(text, user_id)
+
+    for i, page_text in enumerate(pages):
+        page_number = i + 1
+        prompt = build_simplification_prompt(page_text, contexts[i], page_number, audience)
+
+        streamed = False
+        async for delta in stream_perplexity(prompt, SIMPLIFY_SYSTEM_MSG):
+            streamed = True
+            yield {"page_number": page_number, "token": delta}
+
+        if not streamed:
+            log.warning("⚠️  Using mock response for page %s", page_number)
+            mock = generate_mock_response(page_text, page_number, audience)
+            yield {"page_number": page_number, "token": json.dumps(mock)}
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # ASK DOCUMENT (Q&A from uploaded document)
 # ═══════════════════════════════════════════════════════════════════════════════
 
-async def ask_document(text: str, question: str, user_id: str = "default") -> dict:
-    """
-    RAG Q&A: chunk document → FAISS → retrieve relevant context → Perplexity answers.
-    """
-    print(f"\n{'='*60}")
-    print(f"[ASK] Question: {question[:80]}...")
-    print(f"      Document length: {len(text)} chars, user: {user_id}")
-    print(f"{'='*60}")
+ASK_SYSTEM_MSG = "You are a helpful document Q&A assistant. Always respond with valid JSON only."
 
+
+def _ask_context(text: str, question: str, user_id: str) -> str:
+    """Build the vector store for the document and retrieve context for the question."""
+    # Build vector store from document
+    vector_store = None
     try:
-        # Build vector store from document
-        vector_store = None
+        vector_store = get_or_build_vector_store(text, user_id)
+    except Exception as e:
+        log.warning("[ASK] Vector store build failed: %s", e)
+
+    # Retrieve relevant context
+    context = ""
+    if vector_store:
         try:
-            vector_store = build_vector_store(text, user_id)
+            context = retrieve_context(vector_store, question, k=5)
         except Exception as e:
-            print(f"[ASK] Vector store build failed: {e}")
+            log.warning("[ASK] Context retrieval failed: %s", e)
+    return context
 
-        # Retrieve relevant context
-        context = ""
-        if vector_store:
-            try:
-                context = retrieve_context(vector_store, question, k=5)
-            except Exception as e:
-                print(f"[ASK] Context retrieval failed: {e}")
-
-        # Build prompt
-        context_block = ""
-        if context:
-            context_block = f"""
+
+def build_ask_prompt(text: str, question: str, context: str) -> str:
+    """Build the Perplexity prompt for document Q&A."""
+    context_block = ""
+    if context:
+        context_block = f"""
 Here is the relevant context from the uploaded document:
 ---
-{context[:3000]}
+{trim_to_tokens(context, ASK_CONTEXT_TOKENS)}
 ---
 """
-        elif text:
-            context_block = f"""
+    elif text:
+        context_block = f"""
 Here is the document content:
 ---
-{text[:3000]}
+{trim_to_tokens(text, ASK_CONTEXT_TOKENS)}
 ---
 """
 
-        prompt = f"""You are an intelligent document assistant.
+    return f"""You are an intelligent document assistant.
 
 The user has uploaded a document and is asking a question about it.
 {context_block}
@@ -643,8 +1497,28 @@ Respond with a JSON object:
 
 Respond ONLY with the JSON object."""
 
-        system_msg = "You are a helpful document Q&A assistant. Always respond with valid JSON only."
-        raw = await call_perplexity(prompt, system_msg)
+
+def ask_fallback(text: str) -> dict:
+    """Excerpt-based answer used when Perplexity returns nothing usable."""
+    return {
+        "success": True,
+        "answer": f"Based on the document, here is what I found related to your question:\n\n{text[:500]}...\n\n(Note: AI service returned no structured answer, showing document excerpt instead.)",
+        "confidence": "low",
+        "relevant_excerpt": text[:200],
+        "fallback": True,
+    }
+
+
+async def ask_document(text: str, question: str, user_id: str = "default") -> dict:
+    """
+    RAG Q&A: chunk document → FAISS → retrieve relevant context → Perplexity answers.
+    """
+    log.info("[ASK] Question: %s... (document: %d chars, user: %s)", question[:80], len(text), user_id)
+
+    try:
+        context = await asyncio.to_thread(_ask_context, text, question, user_id)
+        prompt = build_ask_prompt(text, question, context)
+        raw = await call_perplexity(prompt, ASK_SYSTEM_MSG)
 
         if raw:
             result = parse_llm_json(raw, 1)
@@ -661,16 +1535,10 @@ Respond ONLY with the JSON object."""
                 }
 
         # Fallback
-        return {
-            "success": True,
-            "answer": f"Based on the document, here is what I found related to your question:\n\n{text[:500]}...\n\n(Note: AI service returned no structured answer, showing document excerpt instead.)",
-            "confidence": "low",
-            "relevant_excerpt": text[:200]
-        }
+        return ask_fallback(text)
 
     except Exception as e:
-        print(f"[ASK] Critical error: {e}")
-        traceback.print_exc()
+        log.exception("[ASK] Critical error: %s", e)
         return {
             "success": False,
             "answer": f"An error occurred while processing your question: {str(e)}",
@@ -679,25 +1547,40 @@ Respond ONLY with the JSON object."""
         }
 
 
+async def ask_document_stream(text: str, question: str,
+                              user_id: str = "default") -> AsyncIterator[dict]:
+    """Streaming variant of ask_document, yielding {"token"} events."""
+    log.info("[ASK/stream] Question: %s... (document: %d chars, user: %s)", question[:80], len(text), user_id)
+
+    context = await asyncio.to_thread(_ask_context, text, question, user_id)
+    prompt = build_ask_prompt(text, question, context)
+
+    streamed = False
+    async for delta in stream_perplexity(prompt, ASK_SYSTEM_MSG):
+        streamed = True
+        yield {"token": delta}
+
+    if not streamed:
+        yield {"token": json.dumps(ask_fallback(text))}
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # SUMMARIZE TEXT (quick single-paragraph summary)
 # ═══════════════════════════════════════════════════════════════════════════════
 
-async def summarize_text(text: str) -> dict:
-    """Generate a concise one-paragraph summary via Perplexity."""
-    print(f"\n{'='*60}")
-    print(f"[SUMMARIZE] Input length: {len(text)} chars")
-    print(f"{'='*60}")
+SUMMARIZE_SYSTEM_MSG = "You are a summarization assistant. Always respond with valid JSON only."
 
-    try:
-        prompt = f"""You are a summarization expert.
+
+def build_summarize_prompt(text: str) -> str:
+    """Build the Perplexity prompt for a one-paragraph summary."""
+    return f"""You are a summarization expert.
 
 Summarize the following text into a clear, concise paragraph (3-5 sentences).
 Focus on the most important points.
 
 Text:
 ---
-{text[:4000]}
+{trim_to_tokens(text, SUMMARIZE_TEXT_TOKENS)}
 ---
 
 Respond with a JSON object:
@@ -709,8 +1592,28 @@ Respond with a JSON object:
 
 Respond ONLY with the JSON object."""
 
-        system_msg = "You are a summarization assistant. Always respond with valid JSON only."
-        raw = await call_perplexity(prompt, system_msg)
+
+def summarize_fallback(text: str) -> dict:
+    """Leading-sentences summary used when Perplexity returns nothing usable."""
+    sentences = _SENT_SPLIT_RE.split(text)
+    key = [s.strip() for s in sentences[:3] if len(s.strip()) > 15]
+    fallback = ". ".join(key) + "." if key else text[:300]
+    return {
+        "success": True,
+        "summary": fallback,
+        "word_count": len(fallback.split()),
+        "key_topics": [],
+        "fallback": True,
+    }
+
+
+async def summarize_text(text: str) -> dict:
+    """Generate a concise one-paragraph summary via Perplexity."""
+    log.info("[SUMMARIZE] Input length: %d chars", len(text))
+
+    try:
+        prompt = build_summarize_prompt(text)
+        raw = await call_perplexity(prompt, SUMMARIZE_SYSTEM_MSG)
 
         if raw:
             result = parse_llm_json(raw, 1)
@@ -725,19 +1628,10 @@ Respond ONLY with the JSON object."""
                 }
 
         # Fallback
-        sentences = re.split(r'[.!?]+', text)
-        key = [s.strip() for s in sentences[:3] if len(s.strip()) > 15]
-        fallback = ". ".join(key) + "." if key else text[:300]
-        return {
-            "success": True,
-            "summary": fallback,
-            "word_count": len(fallback.split()),
-            "key_topics": []
-        }
+        return summarize_fallback(text)
 
     except Exception as e:
-        print(f"[SUMMARIZE] Error: {e}")
-        traceback.print_exc()
+        log.exception("[SUMMARIZE] Error: %s", e)
         return {
             "success": False,
             "summary": f"Summarization failed: {str(e)}",
@@ -746,28 +1640,40 @@ Respond ONLY with the JSON object."""
         }
 
 
+async def summarize_batch(texts: list[str]) -> list[dict]:
+    """Summarize several texts concurrently, one Perplexity call per distinct text."""
+    unique = list(dict.fromkeys(texts))
+    results = await asyncio.gather(*(summarize_text(t) for t in unique))
+    by_text = dict(zip(unique, results))
+    return [by_text[t] for t in texts]
+
+
+async def summarize_text_stream(text: str) -> AsyncIterator[dict]:
+    """Streaming variant of summarize_text, yielding {"token"} events."""
+    log.info("[SUMMARIZE/stream] Input length: %d chars", len(text))
+
+    streamed = False
+    async for delta in stream_perplexity(build_summarize_prompt(text), SUMMARIZE_SYSTEM_MSG):
+        streamed = True
+        yield {"token": delta}
+
+    if not streamed:
+        yield {"token": json.dumps(summarize_fallback(text))}
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # EXTRACT KEY POINTS (bullet-point extraction)
 # ═══════════════════════════════════════════════════════════════════════════════
 
-async def extract_key_points(text: str, user_id: str = "default") -> dict:
-    """Extract structured key points/takeaways from a document via Perplexity."""
-    print(f"\n{'='*60}")
-    print(f"[EXTRACT] Input length: {len(text)} chars, user: {user_id}")
-    print(f"{'='*60}")
+EXTRACT_SYSTEM_MSG = "You are a document analysis assistant. Always respond with valid JSON only."
 
-    try:
-        # Build vector store for context
-        vector_store = None
-        try:
-            vector_store = build_vector_store(text, user_id)
-        except Exception as e:
-            print(f"[EXTRACT] Vector store failed: {e}")
 
-        # Use full text (up to limit) for extraction
-        doc_text = text[:5000]
+def build_extract_prompt(text: str) -> str:
+    """Build the Perplexity prompt for key-point extraction."""
+    # Use full text (up to limit) for extraction
+    doc_text = trim_to_tokens(text, EXTRACT_TEXT_TOKENS)
 
-        prompt = f"""You are an expert analyst.
+    return f"""You are an expert analyst.
 
 Extract the key points and takeaways from the following document.
 
@@ -788,8 +1694,35 @@ Respond with a JSON object:
 
 Extract 5-10 key points. Respond ONLY with the JSON object."""
 
-        system_msg = "You are a document analysis assistant. Always respond with valid JSON only."
-        raw = await call_perplexity(prompt, system_msg)
+
+def extract_fallback(text: str) -> dict:
+    """Simple sentence extraction used when Perplexity returns nothing usable."""
+    sentences = _SENT_SPLIT_RE.split(text)
+    points = [{"point": s.strip(), "importance": "medium"}
+              for s in sentences[:7] if len(s.strip()) > 20]
+    return {
+        "success": True,
+        "key_points": points if points else [{"point": text[:200], "importance": "medium"}],
+        "overall_theme": "Document analysis",
+        "action_items": [],
+        "fallback": True,
+    }
+
+
+async def extract_key_points(text: str, user_id: str = "default") -> dict:
+    """Extract structured key points/takeaways from a document via Perplexity."""
+    log.info("[EXTRACT] Input length: %d chars, user: %s", len(text), user_id)
+
+    try:
+        # Build vector store for context
+        vector_store = None
+        try:
+            vector_store = await asyncio.to_thread(get_or_build_vector_store, text, user_id)
+        except Exception as e:
+            log.warning("[EXTRACT] Vector store failed: %s", e)
+
+        prompt = build_extract_prompt(text)
+        raw = await call_perplexity(prompt, EXTRACT_SYSTEM_MSG)
 
         if raw:
             result = parse_llm_json(raw, 1)
@@ -797,22 +1730,39 @@ Extract 5-10 key points. Respond ONLY with the JSON object."""
                 return {"success": True, **result}
 
         # Fallback: simple sentence extraction
-        sentences = re.split(r'[.!?]+', text)
-        points = [{"point": s.strip(), "importance": "medium"}
-                  for s in sentences[:7] if len(s.strip()) > 20]
-        return {
-            "success": True,
-            "key_points": points if points else [{"point": text[:200], "importance": "medium"}],
-            "overall_theme": "Document analysis",
-            "action_items": []
-        }
+        return extract_fallback(text)
 
     except Exception as e:
-        print(f"[EXTRACT] Error: {e}")
-        traceback.print_exc()
+        log.exception("[EXTRACT] Error: %s", e)
         return {
             "success": False,
             "key_points": [],
             "overall_theme": f"Error: {str(e)}",
             "action_items": []
         }
+
+
+async def extract_batch(items: list[tuple[str, str]]) -> list[dict]:
+    """Extract key points for several (text, user_id) pairs concurrently, deduplicating repeats."""
+    unique = list(dict.fromkeys(items))
+    results = await asyncio.gather(*(extract_key_points(t, u) for t, u in unique))
+    by_item = dict(zip(unique, results))
+    return [by_item[item] for item in items]
+
+
+async def extract_key_points_stream(text: str, user_id: str = "default") -> AsyncIterator[dict]:
+    """Streaming variant of extract_key_points, yielding {"token"} events."""
+    log.info("[EXTRACT/stream] Input length: %d chars, user: %s", len(text), user_id)
+
+    try:
+        await asyncio.to_thread(get_or_build_vector_store, text, user_id)
+    except Exception as e:
+        log.warning("[EXTRACT] Vector store failed: %s", e)
+
+    streamed = False
+    async for delta in stream_perplexity(build_extract_prompt(text), EXTRACT_SYSTEM_MSG):
+        streamed = True
+        yield {"token": delta}
+
+    if not streamed:
+        yield {"token": json.dumps(extract_fallback(text))}
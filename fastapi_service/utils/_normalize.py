@@ -0,0 +1,106 @@
+"""Whitespace / ligature / soft-hyphen cleanup for extracted text."""
+
+import re
+
+try:
+    import numba
+    import numpy as np
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+_NL, _SPACE = 0x0A, 0x20
+# Horizontal whitespace: tab, VT, FF, CR, space
+_HSPACE = (0x09, 0x0B, 0x0C, 0x0D, 0x20)
+# UTF-8 tails (after EF AC) of U+FB00..U+FB04 → ff, fi, fl, ffi, ffl
+_LIGATURES = {0x80: b"ff", 0x81: b"fi", 0x82: b"fl", 0x83: b"ffi", 0x84: b"ffl"}
+
+
+if HAS_NUMBA:
+    @numba.njit(cache=True, boundscheck=False)
+    def _collapse_ws(buf):
+        """
+        Normalise a UTF-8 buffer in place and return the new length.
+        Every rule shrinks or keeps the byte count, so output never
+        overtakes input.
+        """
+        n = buf.shape[0]
+        out = 0
+        i = 0
+        pending_space = False
+        newlines = 0
+        while i < n:
+            b = buf[i]
+            if b == 0x09 or b == 0x0B or b == 0x0C or b == 0x0D or b == 0x20:
+                pending_space = True
+                i += 1
+                continue
+            if b == 0xC2 and i + 1 < n and buf[i + 1] == 0xAD:
+                # soft hyphen, plus the line break it was splitting the word across
+                i += 2
+                if i < n and buf[i] == _NL:
+                    i += 1
+                continue
+            if b == _NL:
+                pending_space = False
+                if out > 0 and newlines < 2:
+                    buf[out] = _NL
+                    out += 1
+                newlines += 1
+                i += 1
+                continue
+            if pending_space and out > 0 and newlines == 0:
+                buf[out] = _SPACE
+                out += 1
+            pending_space = False
+            newlines = 0
+            if b == 0xEF and i + 2 < n and buf[i + 1] == 0xAC and 0x80 <= buf[i + 2] <= 0x84:
+                lig = buf[i + 2]
+                buf[out] = 0x66  # f
+                out += 1
+                if lig == 0x80 or lig == 0x83 or lig == 0x84:
+                    buf[out] = 0x66
+                    out += 1
+                if lig == 0x81 or lig == 0x83:
+                    buf[out] = 0x69  # i
+                    out += 1
+                elif lig == 0x82 or lig == 0x84:
+                    buf[out] = 0x6C  # l
+                    out += 1
+                i += 3
+                continue
+            buf[out] = b
+            out += 1
+            i += 1
+        while out > 0 and buf[out - 1] == _NL:
+            out -= 1
+        return out
+
+
+_LIGATURE_TABLE = str.maketrans({chr(0xFB00 + k - 0x80): v.decode() for k, v in _LIGATURES.items()})
+_HSPACE_RE = re.compile("[" + "".join(map(chr, _HSPACE)) + "]+")
+_SPACE_NL_RE = re.compile(r" ?\n ?")
+_PARA_RE = re.compile(r"\n{3,}")
+
+
+def _normalize_py(text: str) -> str:
+    text = text.replace("\u00ad\n", "").replace("\u00ad", "").translate(_LIGATURE_TABLE)
+    text = _SPACE_NL_RE.sub("\n", _HSPACE_RE.sub(" ", text))
+    return _PARA_RE.sub("\n\n", text).strip(" \n")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse whitespace runs to one space (keeping at most one blank line),
+    expand ff/fi/fl ligatures and drop soft hyphens, joining words they split
+    across lines. Uses the numba kernel when available.
+    """
+    if not text:
+        return text
+    if not HAS_NUMBA:
+        return _normalize_py(text)
+    # PDF extraction can yield lone surrogates; surrogatepass carries them
+    # through as 3-byte sequences the kernel never touches
+    buf = np.frombuffer(text.encode("utf-8", "surrogatepass"), dtype=np.uint8).copy()
+    n = _collapse_ws(buf)
+    return buf[:n].tobytes().decode("utf-8", "surrogatepass")
@@ -1,42 +1,622 @@
 """Utility functions for extracting text from various file formats."""
 
+import asyncio
+import contextlib
+import functools
+import hashlib
+import io
+import logging
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import subprocess
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_from_pdf(file_path: str) -> list[str]:
-    """Extract text from PDF, page by page."""
-    try:
-        import pdfplumber
-        pages = []
-        with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    pages.append(text)
-        return pages
-    except Exception as e:
-        print(f"PDF extraction error: {e}")
+from cachetools import LRUCache
+
+from ._normalize import normalize_text
+
+try:
+    from blake3 import blake3 as _content_hash
+except ImportError:
+    _content_hash = hashlib.sha256
+
+log = logging.getLogger(__name__)
+
+# PDFs with fewer pages than this are parsed in-process; the pool isn't worth it
+PDF_PARALLEL_MIN_PAGES = 8
+
+# Tesseract subprocesses run at once by extract_from_images_async
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", str(os.cpu_count() or 4)))
+
+# Tesseract page segmentation mode. 3 (automatic layout) keeps reading order,
+# which the simplification prompts rely on; 11 (sparse text) suits screenshots.
+OCR_PSM = int(os.getenv("OCR_PSM", "3"))
+# Images whose shorter side is below this are upscaled (up to 4x) before OCR
+OCR_MIN_SIDE = 1000
+# Large JPEGs are decoded straight to grayscale at a reduced scale (1/2, 1/4, 1/8)
+# as long as both sides stay at least this big
+OCR_DRAFT_SIDE = 2048
+# Text already stored in an image's metadata is used instead of OCR if it's at least this long
+EMBEDDED_TEXT_MIN_CHARS = 20
+# Cache namespace for OCR output; includes everything that changes the text
+_OCR_CACHE_KIND = f"ocr-v2-cv-psm{OCR_PSM}-oem1-d{OCR_DRAFT_SIDE}"
+
+# Extraction results keyed by file content: in-process LRU in front of a disk cache
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ocr_cache"))
+
+_pdf_pool = None
+_memory_cache: LRUCache = LRUCache(maxsize=512)
+# LRUCache isn't thread-safe; extraction runs in to_thread workers concurrently
+_memory_cache_lock = threading.Lock()
+_disk_cache = None
+# Per-thread tesserocr handle: the LSTM model is loaded once per thread, not per image
+_tess = threading.local()
+# Reusable text buffers for assembling DOCX output, so batches don't churn the allocator
+_buf_pool: queue.LifoQueue = queue.LifoQueue(maxsize=16)
+
+
+# Heavy parsers are imported on first use (pdfplumber alone costs ~150 ms),
+# then served from these caches instead of re-running the import statement.
+@functools.cache
+def _pdfplumber():
+    import pdfplumber
+    return pdfplumber
+
+
+@functools.cache
+def _pymupdf():
+    import pymupdf
+    return pymupdf
+
+
+@functools.cache
+def _etree():
+    from lxml import etree
+    return etree
+
+
+@functools.cache
+def _pil():
+    import PIL.Image
+    import PIL.ImageOps
+    return PIL
+
+
+@functools.cache
+def _cv2():
+    import cv2
+    return cv2
+
+
+@functools.cache
+def _numpy():
+    import numpy
+    return numpy
+
+
+@functools.cache
+def _tesserocr():
+    import tesserocr
+    return tesserocr
+
+
+@functools.cache
+def _pytesseract():
+    import pytesseract
+    return pytesseract
+
+
+@functools.cache
+def _aiopytesseract():
+    import aiopytesseract
+    return aiopytesseract
+
+
+def _file_digest(file_path: str) -> str:
+    """Content hash of a file, read through mmap instead of into memory."""
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return _content_hash(b"").hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _content_hash(mm).hexdigest()
+
+
+def _get_disk_cache():
+    global _disk_cache
+    if _disk_cache is None:
+        with _memory_cache_lock:
+            if _disk_cache is None:
+                try:
+                    import diskcache
+                    _disk_cache = diskcache.Cache(OCR_CACHE_DIR)
+                except Exception as e:
+                    log.warning("Extraction cache unavailable: %s", e)
+                    _disk_cache = False
+    return _disk_cache or None
+
+
+def _cache_get(key: str):
+    with _memory_cache_lock:
+        value = _memory_cache.get(key)
+    if value is not None:
+        return value
+    cache = _get_disk_cache()
+    value = cache.get(key) if cache is not None else None
+    if value is not None:
+        with _memory_cache_lock:
+            _memory_cache[key] = value
+    return value
+
+
+def _cache_set(key: str, value) -> None:
+    if not value:
+        return  # empty means extraction failed or found nothing; worth retrying
+    with _memory_cache_lock:
+        _memory_cache[key] = value
+    cache = _get_disk_cache()
+    if cache is not None:
+        cache.set(key, value)
+
+
+def _content_cached(kind: str):
+    """Cache an extractor's result by (kind, file content hash)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(file_path: str):
+            try:
+                key = f"{kind}:{_file_digest(file_path)}"
+                cached = _cache_get(key)
+            except Exception:
+                return fn(file_path)  # unreadable file or cache error: let fn report it
+            if cached is not None:
+                return cached
+            result = fn(file_path)
+            try:
+                _cache_set(key, result)
+            except Exception:
+                log.exception("Extraction cache write failed for %s", file_path)
+            return result
+        return wrapper
+    return decorator
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """Shared worker pool for PDF parsing, started on first use."""
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn, not fork: the parent may already be running model/IO threads
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count() or 4,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+
+@contextlib.contextmanager
+def _open_pdfplumber(file_path: str):
+    """
+    pdfplumber over an mmap of the file: pdfminer's many small seeks and
+    reads (xref, object streams) are served from the page cache directly.
+    """
+    with open(file_path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            _pdfplumber().open(mm) as pdf:
+        yield pdf
+
+
+def _extract_pages_chunk(file_path: str, start: int, end: int) -> list[tuple[int, str]]:
+    """Extract pages [start, end) of a PDF; runs inside a pool worker."""
+    with _open_pdfplumber(file_path) as pdf:
+        return [(i, pdf.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def _extract_with_pymupdf(file_path: str) -> list[tuple[int, str]]:
+    """Plain page text via MuPDF; no layout tree, so far cheaper than pdfplumber."""
+    with _pymupdf().open(file_path) as doc:
+        return [(i, page.get_text("text")) for i, page in enumerate(doc)]
+
+
+def _extract_with_pdfplumber(file_path: str) -> list[tuple[int, str]]:
+    with _open_pdfplumber(file_path) as pdf:
+        n = len(pdf.pages)
+        if n < PDF_PARALLEL_MIN_PAGES:
+            return [(i, page.extract_text() or "") for i, page in enumerate(pdf.pages)]
+
+    workers = os.cpu_count() or 4
+    chunk = max(1, n // workers)
+    ranges = [(i, min(i + chunk, n)) for i in range(0, n, chunk)]
+    results = _get_pdf_pool().map(
+        _extract_pages_chunk,
+        [file_path] * len(ranges),
+        [start for start, _ in ranges],
+        [end for _, end in ranges],
+    )
+    return [page for part in results for page in part]
+
+
+@_content_cached("pdf-pages")
+def _extract_pdf_pages(file_path: str) -> list[tuple[int, str]]:
+    """(page index, normalized text) for every page that has text."""
+    try:
+        try:
+            pages = _extract_with_pymupdf(file_path)
+        except ImportError:
+            pages = _extract_with_pdfplumber(file_path)
+        except Exception as e:
+            log.warning("pymupdf failed on %s, retrying with pdfplumber: %s", file_path, e)
+            pages = _extract_with_pdfplumber(file_path)
+        return [(i, text) for i, page in pages if (text := normalize_text(page))]
+    except Exception:
+        log.exception("PDF extraction failed for %s", file_path)
         return []
 
 
+def extract_from_pdf(file_path: str) -> list[str]:
+    """
+    Extract text from PDF, page by page. Uses pymupdf when installed; falls
+    back to pdfplumber (large PDFs split across worker processes).
+    """
+    return [text for _, text in _extract_pdf_pages(file_path)]
+
+
+def extract_pdf_pages(file_path: str):
+    """
+    Like extract_from_pdf, but as parallel arrays: (0-based page indices as an
+    int32 ndarray, texts). Pages without text are left out of both.
+    """
+    pages = _extract_pdf_pages(file_path)
+    indices = _numpy().fromiter((i for i, _ in pages), dtype="int32", count=len(pages))
+    return indices, [text for _, text in pages]
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DOCX_TEXT = {_W + "t": None, _W + "tab": "\t", _W + "br": "\n", _W + "cr": "\n"}
+
+
+def _iter_docx_paragraphs(file_path: str):
+    """
+    Stream paragraph texts straight out of word/document.xml with lxml
+    iterparse, clearing each <w:p> once read so memory stays flat.
+    """
+    etree = _etree()
+    with zipfile.ZipFile(file_path) as z, z.open("word/document.xml") as f:
+        for _, el in etree.iterparse(f, tag=_W + "p"):
+            parts = []
+            for node in el.iter(*_DOCX_TEXT):
+                special = _DOCX_TEXT[node.tag]
+                parts.append((node.text or "") if special is None else special)
+            el.clear()
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+            yield "".join(parts)
+
+
+def _take_buffer() -> io.StringIO:
+    try:
+        return _buf_pool.get_nowait()
+    except queue.Empty:
+        return io.StringIO()
+
+
+def _release_buffer(buf: io.StringIO) -> None:
+    buf.seek(0)
+    buf.truncate()
+    try:
+        _buf_pool.put_nowait(buf)
+    except queue.Full:
+        pass
+
+
+def _write_paragraphs(buf: io.StringIO, texts) -> None:
+    """Write non-blank paragraphs to buf, separated by blank lines."""
+    sep = ""
+    for text in texts:
+        if text.strip():
+            buf.write(sep)
+            buf.write(text)
+            sep = "\n\n"
+
+
 def extract_from_docx(file_path: str) -> str:
     """Extract text from DOCX file."""
+    buf = _take_buffer()
     try:
-        from docx import Document
-        doc = Document(file_path)
-        paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-        return '\n\n'.join(paragraphs)
-    except Exception as e:
-        print(f"DOCX extraction error: {e}")
+        try:
+            _write_paragraphs(buf, _iter_docx_paragraphs(file_path))
+        except ImportError:
+            from docx import Document
+            buf.seek(0)
+            buf.truncate()
+            _write_paragraphs(buf, (p.text for p in Document(file_path).paragraphs))
+        return normalize_text(buf.getvalue())
+    except Exception:
+        log.exception("DOCX extraction failed for %s", file_path)
         return ""
+    finally:
+        _release_buffer(buf)
+
+
+def _load_gray(file_path: str):
+    """
+    Decode an image as 8-bit grayscale. Image.draft lets libjpeg do the
+    colour conversion and downscaling during decode instead of afterwards.
+    """
+    PIL = _pil()
+    with PIL.Image.open(file_path) as img:
+        img.draft("L", (OCR_DRAFT_SIDE, OCR_DRAFT_SIDE))
+        return PIL.ImageOps.exif_transpose(img).convert("L")
+
+
+def _preprocess_image(file_path: str):
+    """
+    Grayscale → upscale small images → bilateral denoise → adaptive threshold,
+    so tesseract gets clean binary input. None if OpenCV is unavailable.
+    """
+    try:
+        cv2, np = _cv2(), _numpy()
+    except ImportError:
+        return None
+    try:
+        img = np.asarray(_load_gray(file_path))
+    except Exception:
+        img = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    shorter = min(img.shape[:2])
+    if shorter < OCR_MIN_SIDE:
+        scale = min(OCR_MIN_SIDE / shorter, 4.0)
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    img = cv2.bilateralFilter(img, 5, 75, 75)
+    return cv2.adaptiveThreshold(img, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY, 31, 10)
+
+
+def _preprocessed_png(file_path: str):
+    """PNG bytes of the preprocessed image, or the original path as a fallback."""
+    img = _preprocess_image(file_path)
+    if img is None:
+        return file_path
+    return _cv2().imencode(".png", img)[1].tobytes()
+
+
+@functools.lru_cache(maxsize=1)
+def _has_tesserocr() -> bool:
+    try:
+        _tesserocr()
+        return True
+    except ImportError:
+        return False
+
+
+def _tess_api():
+    """This thread's PyTessBaseAPI, created on first use; None without tesserocr."""
+    if not _has_tesserocr():
+        return None
+    api = getattr(_tess, "api", None)
+    if api is None:
+        tesserocr = _tesserocr()
+        api = tesserocr.PyTessBaseAPI(lang="eng", psm=OCR_PSM, oem=tesserocr.OEM.LSTM_ONLY)
+        _tess.api = api
+    return api
+
+
+# PNG Description text chunk, which tools use to store an image's text. Comments
+# (PNG Comment, JPEG COM) are mostly encoder boilerplate and generator prompts
+# ("parameters") describe rather than transcribe, so neither is trusted.
+_METADATA_TEXT_KEYS = ("Description", "description")
+# Creator/encoder stamps that still turn up in the trusted fields
+_ENCODER_SIGNATURE_RE = re.compile(
+    r"^(CREATOR:|Created with|File written by|Intel\(R\) JPEG|LEAD Technologies)|gd-jpeg|\bIJG\b",
+    re.IGNORECASE,
+)
+_EXIF_IFD, _EXIF_USER_COMMENT = 0x8769, 0x9286
+
+
+def _decode_user_comment(value) -> str:
+    """EXIF UserComment: 8-byte charset prefix followed by the text."""
+    if not isinstance(value, bytes):
+        return value or ""
+    prefix, body = value[:8], value[8:]
+    encoding = "utf-16" if prefix.startswith(b"UNICODE") else "utf-8"
+    return body.decode(encoding, errors="ignore").strip("\x00")
+
+
+def _embedded_text(file_path: str):
+    """Machine-readable text the image file already carries, or None."""
+    try:
+        with _pil().Image.open(file_path) as img:
+            candidates = [img.info.get(key) for key in _METADATA_TEXT_KEYS]
+            exif = img.getexif().get_ifd(_EXIF_IFD)
+            candidates.append(_decode_user_comment(exif.get(_EXIF_USER_COMMENT)))
+    except Exception:
+        return None
+    for text in candidates:
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="ignore")
+        if (text and len(text := text.strip()) >= EMBEDDED_TEXT_MIN_CHARS
+                and not _ENCODER_SIGNATURE_RE.search(text)):
+            return text
+    return None
+
+
+def _ocr_sync(file_path: str) -> str:
+    img = _preprocess_image(file_path)
+    api = _tess_api()
+    if api is not None:
+        if img is None:
+            api.SetImageFile(file_path)
+        else:
+            height, width = img.shape
+            api.SetImageBytes(img.tobytes(), width, height, 1, width)
+        return api.GetUTF8Text()
+
+    if img is None:
+        img = _load_gray(file_path)
+    return _pytesseract().image_to_string(img, config=f"--psm {OCR_PSM} --oem 1")
+
+
+def _image_text_sync(file_path: str) -> str:
+    return _embedded_text(file_path) or _ocr_sync(file_path)
+
+
+_cached_ocr_sync = _content_cached(_OCR_CACHE_KIND)(_image_text_sync)
+
+
+def ocr_many(file_paths: list[str]) -> list[str]:
+    """OCR several images in this thread, reusing one tesseract handle for all of them."""
+    texts = []
+    for path in file_paths:
+        try:
+            texts.append(_cached_ocr_sync(path))
+        except Exception:
+            log.exception("OCR extraction failed for %s", path)
+            texts.append("")
+    return texts
+
+
+def _tesseract_list(file_paths: list[str]):
+    """
+    OCR images with one tesseract process reading an image-list file.
+    Returns one text per path, or None if the output can't be matched back up.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        images = []
+        for i, path in enumerate(file_paths):
+            img = _preprocessed_png(path)
+            if isinstance(img, bytes):
+                path = os.path.join(tmp, f"{i}.png")
+                with open(path, "wb") as f:
+                    f.write(img)
+            images.append(path)
+        list_path = os.path.join(tmp, "images.txt")
+        with open(list_path, "w") as f:
+            f.write("\n".join(images))
+        out = subprocess.run(
+            ["tesseract", list_path, "-", "--psm", str(OCR_PSM), "--oem", "1"],
+            capture_output=True, check=True,
+        ).stdout.decode("utf-8", errors="replace")
+    # Tesseract ends every page with a form feed. A skipped image or a
+    # multi-page TIFF shifts the count, and then texts can't be attributed.
+    pages = out.split("\x0c")[:-1]
+    return pages if len(pages) == len(file_paths) else None
+
+
+def extract_from_images_batch(file_paths: list[str]) -> list[str]:
+    """
+    OCR several images in one tesseract run instead of one process per image.
+    Results are in input order; failures give "".
+    """
+    if _has_tesserocr():
+        return ocr_many(file_paths)  # already one model load for the whole batch
+
+    texts, keys = [], []
+    for path in file_paths:
+        try:
+            key = f"{_OCR_CACHE_KIND}:{_file_digest(path)}"
+            text = _cache_get(key)
+        except Exception:
+            key, text = None, None
+        keys.append(key)
+        texts.append(text if text is not None else _embedded_text(path))
+
+    pending = [i for i, text in enumerate(texts) if text is None]
+    if pending:
+        try:
+            pages = _tesseract_list([file_paths[i] for i in pending])
+        except (OSError, subprocess.CalledProcessError) as e:
+            log.warning("Batch tesseract run failed, OCRing images one by one: %s", e)
+            pages = None
+        for n, i in enumerate(pending):
+            if pages is not None:
+                texts[i] = pages[n]
+                continue
+            try:
+                texts[i] = _ocr_sync(file_paths[i])
+            except Exception:
+                log.exception("OCR extraction failed for %s", file_paths[i])
+                texts[i] = ""
+
+    for key, text in zip(keys, texts):
+        if key is not None:
+            try:
+                _cache_set(key, text)
+            except Exception:
+                log.exception("Extraction cache write failed")
+    return texts
+
+
+async def _ocr_one(file_path: str, sem: asyncio.Semaphore) -> str:
+    try:
+        key = f"{_OCR_CACHE_KIND}:" + await asyncio.to_thread(_file_digest, file_path)
+        cached = await asyncio.to_thread(_cache_get, key)  # may open/read the SQLite disk cache
+    except Exception:
+        key, cached = None, None
+    if cached is not None:
+        return cached
+    text = await asyncio.to_thread(_embedded_text, file_path)
+    if text is None:
+        async with sem:
+            if _has_tesserocr():
+                # tesserocr releases the GIL, so worker threads OCR in parallel
+                text = await asyncio.to_thread(_ocr_sync, file_path)
+            else:
+                image = await asyncio.to_thread(_preprocessed_png, file_path)
+                text = await _aiopytesseract().image_to_string(image, psm=OCR_PSM, oem=1)
+    if key is not None:
+        try:
+            await asyncio.to_thread(_cache_set, key, text)
+        except Exception:
+            log.exception("Extraction cache write failed for %s", file_path)
+    return text
+
+
+async def extract_from_images_async(file_paths: list[str]) -> list[str]:
+    """
+    OCR several images concurrently, at most OCR_CONCURRENCY tesseract
+    processes at a time. Results are in input order; failures give "".
+    """
+    sem = asyncio.Semaphore(OCR_CONCURRENCY)
+    results = await asyncio.gather(
+        *(_ocr_one(path, sem) for path in file_paths), return_exceptions=True
+    )
+    texts = []
+    for path, result in zip(file_paths, results):
+        if isinstance(result, BaseException):
+            log.error("OCR extraction failed for %s", path, exc_info=result)
+            result = ""
+        texts.append(result)
+    return texts
 
 
 def extract_from_image(file_path: str) -> str:
     """Extract text from image using OCR."""
     try:
-        import pytesseract
-        from PIL import Image
-        img = Image.open(file_path)
-        text = pytesseract.image_to_string(img)
-        return text
-    except Exception as e:
-        print(f"OCR extraction error: {e}")
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(extract_from_images_async([file_path]))[0]
+        # Called from inside an event loop: asyncio.run() isn't allowed here
+        return _cached_ocr_sync(file_path)
+    except Exception:
+        log.exception("OCR extraction failed for %s", file_path)
         return ""
+
+
+# Async entry points for request handlers: parsing runs on the default thread
+# pool (pymupdf, lxml and tesseract release the GIL) instead of the event loop.
+async def extract_from_pdf_async(file_path: str) -> list[str]:
+    return await asyncio.to_thread(extract_from_pdf, file_path)
+
+
+async def extract_from_docx_async(file_path: str) -> str:
+    return await asyncio.to_thread(extract_from_docx, file_path)
+
+
+async def extract_from_image_async(file_path: str) -> str:
+    return (await extract_from_images_async([file_path]))[0]